@@ -9,7 +9,10 @@ from flask import Flask
 from flask_compress import Compress
 from flask_debugtoolbar import DebugToolbarExtension
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy import exc
 from sqlalchemy.pool import NullPool
+from sqlalchemy.pool import QueuePool
 
 HEROKU_APP_NAME = "articlepage"
 
@@ -59,13 +62,67 @@ app.config["SQLALCHEMY_DATABASE_URI"] = os.getenv("DATABASE_URL").replace('postg
 app.config["SQLALCHEMY_BINDS"] = {"openalex": openalex_db_url}
 app.config['SQLALCHEMY_ECHO'] = (os.getenv("SQLALCHEMY_ECHO", False) == "True")
 
+def db_process_type():
+    # heroku sets DYNO to something like web.1 or refresh.3
+    return "web" if os.getenv("DYNO", "").startswith("web") else "worker"
+
+
+def db_pool_setting(name, default):
+    # DB_POOL_MODE_WEB overrides DB_POOL_MODE for web dynos, DB_POOL_SIZE_WORKER overrides DB_POOL_SIZE for workers, etc.
+    return os.getenv("{}_{}".format(name, db_process_type().upper()), os.getenv(name, default))
+
+
+def db_pool_mode():
+    # "null" opens a connection per checkout, for processes behind pgbouncer.
+    # "queue" keeps a bounded pool of connections in the process.
+    return db_pool_setting("DB_POOL_MODE", "null")
+
+
 # from http://stackoverflow.com/a/12417346/596939
 class NullPoolSQLAlchemy(SQLAlchemy):
     def apply_driver_hacks(self, app, info, options):
         options['poolclass'] = NullPool
         return super(NullPoolSQLAlchemy, self).apply_driver_hacks(app, info, options)
 
-db = NullPoolSQLAlchemy(app, session_options={"autoflush": False})
+
+class QueuePoolSQLAlchemy(SQLAlchemy):
+    def apply_driver_hacks(self, app, info, options):
+        options['poolclass'] = QueuePool
+        options['pool_size'] = int(db_pool_setting("DB_POOL_SIZE", 5))
+        options['max_overflow'] = int(db_pool_setting("DB_POOL_MAX_OVERFLOW", 5))
+        options['pool_timeout'] = int(db_pool_setting("DB_POOL_TIMEOUT", 30))
+        options['pool_recycle'] = int(db_pool_setting("DB_POOL_RECYCLE", 1800))
+        options['pool_pre_ping'] = True
+        return super(QueuePoolSQLAlchemy, self).apply_driver_hacks(app, info, options)
+
+    def create_engine(self, sa_url, engine_opts):
+        engine = super(QueuePoolSQLAlchemy, self).create_engine(sa_url, engine_opts)
+        add_fork_guard(engine)
+        return engine
+
+
+def add_fork_guard(engine):
+    # from https://docs.sqlalchemy.org/en/14/core/pooling.html#using-connection-pools-with-multiprocessing-or-os-fork
+    # a forked child must not reuse the parent's pooled connections, so it makes its own instead
+    @event.listens_for(engine, "connect")
+    def connect(dbapi_connection, connection_record):
+        connection_record.info['pid'] = os.getpid()
+
+    @event.listens_for(engine, "checkout")
+    def checkout(dbapi_connection, connection_record, connection_proxy):
+        pid = os.getpid()
+        if connection_record.info['pid'] != pid:
+            connection_record.dbapi_connection = connection_proxy.dbapi_connection = None
+            raise exc.DisconnectionError(
+                "Connection record belongs to pid {}, attempting to check out in pid {}".format(
+                    connection_record.info['pid'], pid)
+            )
+
+
+if db_pool_mode() == "queue":
+    db = QueuePoolSQLAlchemy(app, session_options={"autoflush": False})
+else:
+    db = NullPoolSQLAlchemy(app, session_options={"autoflush": False})
 
 # do compression.  has to be above flask debug toolbar so it can override this.
 compress_json = os.getenv("COMPRESS_DEBUG", "False")=="True"
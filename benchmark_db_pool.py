@@ -0,0 +1,63 @@
+import argparse
+import os
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+"""
+Request latency for each DB_POOL_MODE, measured in-process with the flask test client against DATABASE_URL.
+
+python benchmark_db_pool.py --doi 10.1234/example --requests 1000 --concurrency 4
+
+The pool is chosen when app is imported, so each mode runs in its own child process.
+The default path serves the stored response for the DOI without recalculating it,
+so the time is mostly getting a connection and reading one row.
+"""
+
+MODES = ["null", "queue"]
+DEFAULT_PATH = "/v2/{doi}?email=unpaywall@impactstory.org"
+
+
+def percentile(sorted_values, p):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p / 100))]
+
+
+def measure(path, num_requests, concurrency):
+    from views import app
+
+    def timed_get(i):
+        client = app.test_client()
+        start = perf_counter()
+        response = client.get(path)
+        return response.status_code, (perf_counter() - start) * 1000
+
+    # the first request opens connections and warms up lazy imports
+    timed_get(0)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(timed_get, range(num_requests)))
+
+    errors = len([status for status, ms in results if status != 200])
+    latencies = sorted(ms for status, ms in results)
+    print("DB_POOL_MODE={}: {} requests, {} errors, p50 {:.2f} ms, p99 {:.2f} ms".format(
+        os.getenv("DB_POOL_MODE"), len(results), errors, percentile(latencies, 50), percentile(latencies, 99)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare request latency across DB_POOL_MODE settings.")
+    parser.add_argument('--doi', required=True, help="a DOI in the pub table")
+    parser.add_argument('--path', default=DEFAULT_PATH, help="request path, {doi} is filled in")
+    parser.add_argument('--requests', type=int, default=1000, help="requests per mode")
+    parser.add_argument('--concurrency', type=int, default=4, help="requests in flight at once")
+    parser.add_argument('--mode', choices=MODES, help="run one mode in this process instead of all of them")
+    parsed_args = parser.parse_args()
+
+    if parsed_args.mode:
+        measure(parsed_args.path.format(doi=parsed_args.doi), parsed_args.requests, parsed_args.concurrency)
+    else:
+        for mode in MODES:
+            env = dict(os.environ, DB_POOL_MODE=mode)
+            env.pop("DB_POOL_MODE_WEB", None)
+            env.pop("DB_POOL_MODE_WORKER", None)
+            subprocess.run([sys.executable] + sys.argv + ["--mode", mode], env=env, check=True)
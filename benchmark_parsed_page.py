@@ -0,0 +1,64 @@
+import argparse
+import glob
+import os
+from time import perf_counter
+
+import webpage
+
+"""
+Runs the tree-based extractors that the publisher and repo scrapes call, over a directory of saved html pages,
+passing each extractor the html string (every extractor parses it again, how the scrapes used to work)
+and passing them one shared ParsedPage. Reports lxml parses and time per page for both.
+
+python benchmark_parsed_page.py --pages test/fixtures/webpages --repeat 50
+"""
+
+# a repo url that find_bhl_view_link looks at, so it gets the page's links like it would on a real bhl page
+BHL_URL = 'https://www.biodiversitylibrary.org/part/1'
+
+
+def publisher_extractors(page):
+    webpage.page_potential_license_text(page)
+    webpage.get_pdf_in_meta(page)
+    webpage.get_useful_links(page)
+
+
+def repo_extractors(page):
+    webpage.get_pdf_in_meta(page)
+    webpage.get_useful_links(page)
+    webpage.find_doc_download_link(page)
+    webpage.find_bhl_view_link(BHL_URL, page)
+
+
+def run(html_pages, extractors, share_tree, repeat):
+    parses_before = webpage.ParsedPage.parse_count
+    start = perf_counter()
+
+    for i in range(repeat):
+        for html in html_pages:
+            extractors(webpage.ParsedPage(html) if share_tree else html)
+
+    runs = repeat * len(html_pages)
+    parses = webpage.ParsedPage.parse_count - parses_before
+    return parses / runs, (perf_counter() - start) / runs
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark sharing one parsed tree across the scrape extractors.")
+    parser.add_argument('--pages', default=os.path.join('test', 'fixtures', 'webpages'), help="directory of .html files")
+    parser.add_argument('--repeat', type=int, default=50, help="times to process each page")
+    parsed_args = parser.parse_args()
+
+    html_pages = []
+    for path in sorted(glob.glob(os.path.join(parsed_args.pages, '*.html'))):
+        with open(path) as f:
+            html_pages.append(f.read())
+
+    if not html_pages:
+        raise SystemExit('no .html files in {}'.format(parsed_args.pages))
+
+    print('{} pages, {} repeats'.format(len(html_pages), parsed_args.repeat))
+    for scrape, extractors in [('publisher', publisher_extractors), ('repo', repo_extractors)]:
+        for label, share_tree in [('html string', False), ('shared tree', True)]:
+            parses, seconds = run(html_pages, extractors, share_tree, parsed_args.repeat)
+            print('{} scrape, {}: {:.1f} parses/page, {:.3f} ms/page'.format(scrape, label, parses, seconds * 1000))
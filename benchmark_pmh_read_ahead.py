@@ -0,0 +1,98 @@
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import perf_counter, sleep
+from urllib.parse import parse_qs, urlparse
+
+from endpoint import MyOAIItemIterator, MySickle
+
+"""
+Harvests ListRecords from a local OAI-PMH stand-in with and without read-ahead and compares records per second.
+
+python benchmark_pmh_read_ahead.py --latency 0.2 --pages 10 --per-page 50
+
+--latency is how long the stand-in takes to answer each page. --record-ms is time spent per record,
+like call_pmh_endpoint populating and saving it. Read-ahead helps most when the two add up to about the same per page.
+"""
+
+
+def page_xml(page, pages, per_page):
+    records = ''.join(
+        '<record><header><identifier>oai:standin:{page}-{i}</identifier><datestamp>2020-01-01</datestamp></header>'
+        '<metadata><oai_dc:dc xmlns:oai_dc="http://www.openarchives.org/OAI/2.0/oai_dc/" '
+        'xmlns:dc="http://purl.org/dc/elements/1.1/"><dc:title>record {page}-{i}</dc:title></oai_dc:dc></metadata>'
+        '</record>'.format(page=page, i=i)
+        for i in range(per_page)
+    )
+    token = '<resumptionToken>{}</resumptionToken>'.format(page + 1) if page + 1 < pages else '<resumptionToken/>'
+    return (
+        '<?xml version="1.0"?><OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/">'
+        '<ListRecords>{}{}</ListRecords></OAI-PMH>'.format(records, token)
+    ).encode('utf-8')
+
+
+def start_stand_in(latency, pages, per_page):
+    class StandInHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            sleep(latency)
+            params = parse_qs(urlparse(self.path).query)
+            page = int(params.get('resumptionToken', ['0'])[0])
+            body = page_xml(page, pages, per_page)
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/xml')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, 'http://127.0.0.1:{}/oai'.format(server.server_port)
+
+
+def harvest(url, read_ahead, record_seconds):
+    my_sickle = MySickle(url, iterator=MyOAIItemIterator, read_ahead=read_ahead, timeout=10)
+    identifiers = []
+    start = perf_counter()
+
+    try:
+        for record in my_sickle.ListRecords(metadataPrefix='oai_dc'):
+            sleep(record_seconds)
+            identifiers.append(record.header.identifier)
+    finally:
+        my_sickle.stop_read_ahead()
+
+    return perf_counter() - start, identifiers
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark ListRecords read-ahead against a local OAI-PMH stand-in.")
+    parser.add_argument('--latency', type=float, default=0.2, help="seconds the stand-in takes per page")
+    parser.add_argument('--pages', type=int, default=10, help="pages in the list")
+    parser.add_argument('--per-page', type=int, default=50, help="records per page")
+    parser.add_argument('--record-ms', type=float, default=None, help="ms of work per record, default latency/per-page")
+    parsed_args = parser.parse_args()
+
+    record_ms = parsed_args.record_ms
+    if record_ms is None:
+        record_ms = parsed_args.latency * 1000 / parsed_args.per_page
+
+    server, url = start_stand_in(parsed_args.latency, parsed_args.pages, parsed_args.per_page)
+    try:
+        results = dict(
+            (read_ahead, harvest(url, read_ahead, record_ms / 1000)) for read_ahead in [False, True]
+        )
+    finally:
+        server.shutdown()
+
+    num_records = parsed_args.pages * parsed_args.per_page
+    for read_ahead, (seconds, identifiers) in results.items():
+        print('read_ahead={}: {} records in {:.2f}s, {:.0f} records/s'.format(
+            read_ahead, len(identifiers), seconds, len(identifiers) / seconds))
+
+    if results[False][1] != results[True][1] or len(results[True][1]) != num_records:
+        raise SystemExit('read-ahead returned different records')
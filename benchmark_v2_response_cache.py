@@ -0,0 +1,69 @@
+import argparse
+import random
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+import requests
+
+"""
+Load test for the /v2/<doi> response cache. Point it at a running web process, e.g.
+
+V2_RESPONSE_CACHE=lru gunicorn views:app -w 1 --threads 8
+python benchmark_v2_response_cache.py --url http://localhost:8000 --dois dois.txt --email you@example.com
+
+The first pass requests every DOI once, filling the cache. The second pass sends --requests more requests
+for DOIs chosen at random, so they should all be cache hits. Run it again with V2_RESPONSE_CACHE unset
+to see the uncached latency.
+"""
+
+
+def timed_get(session, url):
+    start = perf_counter()
+    response = session.get(url)
+    return response.status_code, (perf_counter() - start) * 1000
+
+
+def run_pass(base_url, dois, email, concurrency):
+    session = requests.Session()
+    session.mount('http://', requests.adapters.HTTPAdapter(pool_maxsize=concurrency))
+    session.mount('https://', requests.adapters.HTTPAdapter(pool_maxsize=concurrency))
+    urls = ['{}/v2/{}?email={}'.format(base_url, doi, email) for doi in dois]
+
+    start = perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(lambda url: timed_get(session, url), urls))
+    seconds = perf_counter() - start
+
+    errors = len([status for status, ms in results if status != 200])
+    latencies = sorted(ms for status, ms in results)
+    return {
+        'requests': len(results),
+        'errors': errors,
+        'requests_per_second': round(len(results) / seconds, 1),
+        'p50_ms': round(percentile(latencies, 50), 2),
+        'p99_ms': round(percentile(latencies, 99), 2),
+    }
+
+
+def percentile(sorted_values, p):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p / 100))]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the /v2/<doi> response cache.")
+    parser.add_argument('--url', default='http://localhost:5000', help="base url of a running web process")
+    parser.add_argument('--dois', required=True, help="file with one DOI per line")
+    parser.add_argument('--email', required=True, help="email parameter to send")
+    parser.add_argument('--requests', type=int, default=5000, help="requests in the warm pass")
+    parser.add_argument('--concurrency', type=int, default=8, help="requests in flight at once")
+    parsed_args = parser.parse_args()
+
+    with open(parsed_args.dois) as f:
+        dois = [line.strip() for line in f if line.strip()]
+
+    cold = run_pass(parsed_args.url, dois, parsed_args.email, parsed_args.concurrency)
+    print('cold pass: {}'.format(cold))
+
+    warm_dois = [random.choice(dois) for i in range(parsed_args.requests)]
+    warm = run_pass(parsed_args.url, warm_dois, parsed_args.email, parsed_args.concurrency)
+    print('warm pass: {}'.format(warm))
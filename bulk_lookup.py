@@ -0,0 +1,130 @@
+import json
+import os
+
+import unicodecsv
+from openpyxl import Workbook
+from sqlalchemy import text
+
+from app import db
+from app import logger
+from pub import Pub
+from pub import build_new_pub
+from pub import csv_dict_from_response_dict
+from util import chunks
+from util import clean_doi, normalize_doi
+
+
+def lookup_v2_responses(dirty_dois):
+    """Returns /v2 responses for dirty_dois in the same order, using one query for the whole list."""
+    normalized_dois = [normalize_doi(d, return_none_if_error=True) for d in dirty_dois]
+    cleaned_dois = [clean_doi(d, return_none_if_error=True) for d in dirty_dois]
+    ids = list(set([d for d in normalized_dois + cleaned_dois if d]))
+
+    responses_by_doi = {}
+    if ids:
+        rows = db.session.execute(
+            text(f'select response_jsonb from {Pub.__tablename__} where id = any(:ids)'),
+            {'ids': ids}
+        ).fetchall()
+        responses_by_doi = dict([(row[0]['doi'], row[0]) for row in rows if row[0]])
+
+    return [
+        responses_by_doi.get(normalized_doi, None)
+        or responses_by_doi.get(cleaned_doi, None)
+        or build_new_pub(dirty_doi, None).to_dict_v2()
+        for dirty_doi, normalized_doi, cleaned_doi in zip(dirty_dois, normalized_dois, cleaned_dois)
+    ]
+
+
+class BulkLookupFiles(object):
+    """Writes /v2/dois results to output files in output_dir one response at a time."""
+
+    def __init__(self, output_dir, formats):
+        self.output_dir = output_dir
+        self.formats = formats
+        self.jsonl_file = None
+        self.csv_file = None
+        self.csv_writer = None
+        self.fieldnames = None
+        self.book = None
+        self.sheet = None
+
+        if "jsonl" in formats:
+            self.jsonl_file = open(self.path("jsonl"), 'w')
+
+        if "xlsx" in formats:
+            # write-only workbooks stream rows instead of keeping every cell in memory
+            self.book = Workbook(write_only=True)
+            self.sheet = self.book.create_sheet("results")
+
+    def path(self, file_format):
+        return os.path.join(self.output_dir, "output.{}".format(file_format))
+
+    def write(self, response_dict):
+        if self.jsonl_file:
+            self.jsonl_file.write(json.dumps(response_dict, sort_keys=True))
+            self.jsonl_file.write("\n")
+
+        csv_dict = csv_dict_from_response_dict(response_dict)
+        if not csv_dict:
+            return
+
+        if not self.fieldnames:
+            self.start_tables(csv_dict)
+
+        if self.csv_writer:
+            self.csv_writer.writerow(csv_dict)
+
+        if self.sheet:
+            self.sheet.append([csv_dict[field_name] for field_name in self.fieldnames])
+
+    def start_tables(self, csv_dict):
+        fieldnames = sorted(csv_dict.keys())
+        self.fieldnames = ["doi"] + [name for name in fieldnames if name != "doi"]
+
+        if "csv" in self.formats:
+            self.csv_file = open(self.path("csv"), 'wb')
+            self.csv_writer = unicodecsv.DictWriter(self.csv_file, fieldnames=self.fieldnames, dialect='excel')
+            self.csv_writer.writeheader()
+
+        if self.sheet:
+            self.sheet.append(self.fieldnames)
+
+    def close(self):
+        """Finishes the files and returns their paths."""
+        files = []
+
+        if self.jsonl_file:
+            self.jsonl_file.close()
+            files.append(self.path("jsonl"))
+
+        if self.csv_file:
+            self.csv_file.close()
+            files.append(self.path("csv"))
+
+        if self.book:
+            self.book.save(filename=self.path("xlsx"))
+            files.append(self.path("xlsx"))
+
+        return files
+
+
+def write_bulk_lookup_files(dirty_dois, output_files, chunk_size):
+    """Looks up dirty_dois chunk_size at a time and writes the responses to output_files.
+
+    Yields (dois done, total dois, response dois in the chunk) after each chunk.
+    """
+    total = len(dirty_dois)
+    done = 0
+
+    for dois_chunk in chunks(dirty_dois, chunk_size):
+        responses = lookup_v2_responses(dois_chunk)
+        for response_dict in responses:
+            output_files.write(response_dict)
+
+        # the responses are written, so the session doesn't need to keep anything from this chunk
+        db.session.expunge_all()
+
+        done += len(dois_chunk)
+        logger.info('bulk lookup: wrote {} of {} dois'.format(done, total))
+        yield done, total, [r['doi'] for r in responses]
@@ -1,6 +1,10 @@
 import json
+import os
+import threading
+from time import time
 
 import boto
+from cachetools import TTLCache
 from sqlalchemy import sql
 
 from app import db
@@ -33,6 +37,68 @@ def valid_changefile_api_keys():
     ).fetchall()]
 
 
+class ChangefileApiKeyCache(object):
+    """Per-process copy of the valid changefile API keys.
+
+    The key set is reloaded after ttl_seconds. An unknown key forces an early reload, so a key issued
+    a moment ago works right away, and is then remembered as invalid for negative_ttl_seconds so
+    repeated requests with a bad key don't each reload the set.
+    """
+
+    def __init__(self, load_keys, ttl_seconds, negative_ttl_seconds, clock=time):
+        self.load_keys = load_keys
+        self.ttl_seconds = ttl_seconds
+        self.clock = clock
+        self.invalid_keys = TTLCache(maxsize=10000, ttl=negative_ttl_seconds, timer=clock)
+        self.valid_keys = None
+        self.loaded_at = None
+        self.lock = threading.Lock()
+
+    def reload(self):
+        self.valid_keys = set(self.load_keys())
+        self.loaded_at = self.clock()
+
+    def is_valid(self, api_key):
+        with self.lock:
+            if self.valid_keys is None or self.clock() - self.loaded_at > self.ttl_seconds:
+                self.reload()
+
+            if api_key in self.valid_keys:
+                return True
+
+            if api_key in self.invalid_keys:
+                return False
+
+            self.reload()
+            if api_key in self.valid_keys:
+                return True
+
+            self.invalid_keys[api_key] = True
+            return False
+
+    def invalidate(self):
+        with self.lock:
+            self.valid_keys = None
+            self.loaded_at = None
+            self.invalid_keys.clear()
+
+
+_api_key_cache = ChangefileApiKeyCache(
+    valid_changefile_api_keys,
+    ttl_seconds=int(os.getenv('CHANGEFILE_API_KEY_CACHE_SECONDS', 300)),
+    negative_ttl_seconds=int(os.getenv('CHANGEFILE_INVALID_API_KEY_CACHE_SECONDS', 60)),
+)
+
+
+def is_valid_changefile_api_key(api_key):
+    return _api_key_cache.is_valid(api_key)
+
+
+def invalidate_changefile_api_keys():
+    # call after adding or revoking keys to make this process reload them
+    _api_key_cache.invalidate()
+
+
 def get_file_from_bucket(filename, feed=WEEKLY_FEED):
     s3 = boto.connect_s3()
     bucket = s3.get_bucket(feed['bucket'])
@@ -42,3 +42,31 @@ def doaj_titles():
             ).fetchall()
         ]
     return _doaj_titles
+
+
+_doaj_issn_index = {}
+
+
+def doaj_issn_index():
+    # hyphenless issn -> [(license, start year)], in the same order as doaj_issns()
+    global _doaj_issn_index
+    if not _doaj_issn_index:
+        index = {}
+        for (row_issn_no_hyphen, row_license, doaj_start_year) in doaj_issns():
+            index.setdefault(row_issn_no_hyphen, []).append((row_license, doaj_start_year))
+        _doaj_issn_index = index
+    return _doaj_issn_index
+
+
+_doaj_title_index = {}
+
+
+def doaj_title_index():
+    # stripped, lowercased utf-8 title -> [(license, start year)], in the same order as doaj_titles()
+    global _doaj_title_index
+    if not _doaj_title_index:
+        index = {}
+        for (row_journal_name, row_license, doaj_start_year) in doaj_titles():
+            index.setdefault(row_journal_name.strip().lower(), []).append((row_license, doaj_start_year))
+        _doaj_title_index = index
+    return _doaj_title_index
@@ -4,6 +4,7 @@ import os
 import re
 import time
 from argparse import ArgumentParser
+from collections import defaultdict
 from datetime import datetime
 from gzip import decompress
 from io import BytesIO
@@ -11,7 +12,6 @@ from queue import Queue, Empty
 from threading import Thread
 
 import boto3
-import botocore
 import requests
 from bs4 import BeautifulSoup
 from pyalex import Works
@@ -21,7 +21,7 @@ from sqlalchemy.engine import Engine
 from app import app, logger
 from http_cache import http_get
 from pdf_util import PDFVersion
-from s3_util import get_landing_page
+from s3_util import check_exists, get_landing_page
 
 TOTAL_ATTEMPTED = 0
 SUCCESSFUL = 0
@@ -80,11 +80,7 @@ def normalize_doi(doi):
 
 
 def pdf_exists(key, s3):
-    try:
-        s3.get_object(Bucket=S3_PDF_BUCKET_NAME, Key=key)
-        return True
-    except botocore.exceptions.ClientError as e:
-        return False
+    return check_exists(S3_PDF_BUCKET_NAME, key, s3=s3)
 
 
 # @retry(retry=retry_if_exception_type(
@@ -165,9 +161,10 @@ def download_pdfs(url_q: Queue, parse_q: Queue):
         doi, url, version = None, None, None
         try:
             version: PDFVersion
-            doi, url, version = url_q.get(timeout=30)
+            doi, url, version, known_missing = url_q.get(timeout=30)
             key = version.s3_key(doi)
-            if version.in_s3(doi):
+            # skip_existing_pdfs already listed it as missing unless its check failed
+            if not known_missing and version.in_s3(doi):
                 ALREADY_EXIST += 1
                 continue
             if not url:
@@ -211,6 +208,35 @@ def try_parse_pdf_url(doi):
     return parse_pdf_url(html)
 
 
+def skip_existing_pdfs(rows):
+    # check the whole chunk with s3 listings so download threads don't get pdfs we already have.
+    # returns (row, known_missing) for the rows to download. known_missing is False if we couldn't check.
+    global ALREADY_EXIST
+    global TOTAL_ATTEMPTED
+    dois_by_version = defaultdict(list)
+    for row in rows:
+        dois_by_version[PDFVersion.from_version_str(row['version'])].append(row['id'])
+
+    existing = set()
+    try:
+        for version, dois in dois_by_version.items():
+            if version:
+                existing.update((doi, version) for doi in version.dois_in_s3(dois))
+    except Exception as e:
+        logger.exception(f'error checking s3 for existing pdfs: {e}')
+        return [(row, False) for row in rows]
+
+    ALREADY_EXIST += len(existing)
+    TOTAL_ATTEMPTED += len(existing)
+
+    rows_to_download = []
+    for row in rows:
+        version = PDFVersion.from_version_str(row['version'])
+        if (row['id'], version) not in existing:
+            rows_to_download.append((row, bool(version)))
+    return rows_to_download
+
+
 def enqueue_from_db(url_q: Queue):
     query = f'''WITH queue as (
                 SELECT * FROM pdf_save_queue WHERE in_progress = false
@@ -228,9 +254,11 @@ def enqueue_from_db(url_q: Queue):
             rows = conn.execute(
                 text(query).execution_options(autocommit=True,
                                               autoflush=True)).all()
-            for row in rows:
+            rows_to_download = skip_existing_pdfs(rows)
+            for row, known_missing in rows_to_download:
                 url_q.put((row['id'], row['scrape_pdf_url'],
-                           PDFVersion.from_version_str(row['version'])))
+                           PDFVersion.from_version_str(row['version']),
+                           known_missing))
             if not rows:
                 break
             ids = [row['id'] for row in rows]
@@ -245,8 +273,11 @@ def enqueue_from_api(url_q: Queue):
     global PDF_URL_NOT_FOUND
     for page in pager:
         for work in page:
-            pdf_url = work['best_oa_location']['pdf_url']
-            url_q.put((work['doi'], pdf_url))
+            best_oa_location = work.get('best_oa_location') or {}
+            version = best_oa_location.get('version') and PDFVersion.from_version_str(best_oa_location['version'])
+            if not version:
+                continue
+            url_q.put((work['doi'], best_oa_location['pdf_url'], version, False))
 
 
 def parse_args():
@@ -1,3 +1,4 @@
+import concurrent.futures
 import datetime
 import json
 import os
@@ -23,6 +24,11 @@ from util import elapsed
 from util import safe_commit
 
 
+def _pmh_read_ahead():
+    # fetch the next ListRecords page in the background while the current one is processed
+    return os.getenv('PMH_READ_AHEAD', 'False') == 'True'
+
+
 def lookup_endpoint_by_pmh_url(pmh_url_query=None):
     endpoints = Endpoint.query.filter(Endpoint.pmh_url.ilike("%{}%".format(pmh_url_query))).all()
     return endpoints
@@ -206,12 +212,12 @@ class Endpoint(db.Model):
             if use_date_default_format:
                 return self.get_recent_pmh_record(use_date_default_format=False)
 
-    def get_pmh_input_record(self, first, last, use_date_default_format=True):
+    def get_pmh_input_record(self, first, last, use_date_default_format=True, read_ahead=False):
         args = {'metadataPrefix': self.metadata_prefix}
         pmh_records = []
         self.error = None
 
-        my_sickle = _get_my_sickle(self.pmh_url)
+        my_sickle = _get_my_sickle(self.pmh_url, read_ahead=read_ahead)
         logger.info("connected to sickle with {}".format(self.pmh_url))
 
         args['from'] = first.isoformat()[0:10]
@@ -236,7 +242,7 @@ class Endpoint(db.Model):
                 pmh_input_record = None
             except BadArgument as e:
                 if use_date_default_format:
-                    return self.get_pmh_input_record(first, last, use_date_default_format=False)
+                    return self.get_pmh_input_record(first, last, use_date_default_format=False, read_ahead=read_ahead)
                 else:
                     raise e
         except Exception as e:
@@ -252,7 +258,8 @@ class Endpoint(db.Model):
                           first=None,
                           last=None,
                           chunk_size=50,
-                          scrape=False):
+                          scrape=False,
+                          read_ahead=None):
 
         start_time = time()
         records_to_save = []
@@ -260,47 +267,47 @@ class Endpoint(db.Model):
         loop_counter = 0
         self.error = None
 
-        (pmh_input_record, pmh_records, error) = self.get_pmh_input_record(first, last)
+        if read_ahead is None:
+            read_ahead = _pmh_read_ahead()
+
+        (pmh_input_record, pmh_records, error) = self.get_pmh_input_record(first, last, read_ahead=read_ahead)
 
         if error:
             self.error = "error in get_pmh_input_record: {}".format(error)
+            _stop_read_ahead(pmh_records)
             return
 
-        while pmh_input_record:
-            loop_counter += 1
-            # create the record
-            my_pmh_record = pmh_record.PmhRecord()
-
-            # set its vars
-            my_pmh_record.repo_id = self.id_old  # delete once endpoint_ids are all populated
-            my_pmh_record.rand = random()
-            my_pmh_record.populate(self.id, pmh_input_record, metadata_prefix=self.metadata_prefix)
-
-            if is_complete(my_pmh_record):
-                my_pages = my_pmh_record.mint_pages(reset_scrape_date=True)
-                my_pmh_record.pages = my_pages
-                if scrape:
-                    for my_page in my_pages:
-                        my_page.scrape_if_matches_pub()
-                records_to_save.append(my_pmh_record)
-                my_pmh_record.delete_old_record()
-                db.session.merge(my_pmh_record)
-                db.session.flush()
-                my_pmh_record.enqueue_representative_page()
-            else:
-                logger.info("pmh record is not complete")
-                # print my_pmh_record
-                pass
+        try:
+            while pmh_input_record:
+                loop_counter += 1
+                # create the record
+                my_pmh_record = pmh_record.PmhRecord()
+
+                # set its vars
+                my_pmh_record.repo_id = self.id_old  # delete once endpoint_ids are all populated
+                my_pmh_record.rand = random()
+                my_pmh_record.populate(self.id, pmh_input_record, metadata_prefix=self.metadata_prefix)
+
+                if is_complete(my_pmh_record):
+                    records_to_save.append(my_pmh_record)
+                else:
+                    logger.info("pmh record is not complete")
+                    # print my_pmh_record
+                    pass
 
-            if len(records_to_save) >= chunk_size:
-                num_records_updated += len(records_to_save)
-                safe_commit(db)
-                records_to_save = []
+                if len(records_to_save) >= chunk_size:
+                    num_records_updated += len(records_to_save)
+                    self.save_pmh_records(records_to_save, scrape)
+                    safe_commit(db)
+                    records_to_save = []
 
-            if loop_counter % 100 == 0:
-                logger.info("iterated through 100 more items, loop_counter={} for {}".format(loop_counter, self.id))
+                if loop_counter % 100 == 0:
+                    logger.info("iterated through 100 more items, loop_counter={} for {}".format(loop_counter, self.id))
 
-            pmh_input_record = self.safe_get_next_record(pmh_records)
+                pmh_input_record = self.safe_get_next_record(pmh_records)
+        finally:
+            # don't leave a page fetching in the background once the harvest is over or has failed
+            _stop_read_ahead(pmh_records)
 
         # make sure to get the last ones
         if records_to_save:
@@ -308,6 +315,7 @@ class Endpoint(db.Model):
             last_record = records_to_save[-1]
             logger.info("saving {} last ones, last record saved: {} for {}, loop_counter={}".format(
                 len(records_to_save), last_record.id, self.id, loop_counter))
+            self.save_pmh_records(records_to_save, scrape)
             safe_commit(db)
         else:
             logger.info("finished loop, but no records to save, loop_counter={}".format(loop_counter))
@@ -315,6 +323,20 @@ class Endpoint(db.Model):
         logger.info("updated {} PMH records for endpoint_id={}, took {} seconds".format(
             num_records_updated, self.id, elapsed(start_time, 2)))
 
+    def save_pmh_records(self, records, scrape=False):
+        # mint pages for the whole batch at once, then save the records one by one
+        record_pages = pmh_record.mint_pages_for_records(records, reset_scrape_date=True)
+
+        for my_pmh_record, my_pages in zip(records, record_pages):
+            my_pmh_record.pages = my_pages
+            if scrape:
+                for my_page in my_pages:
+                    my_page.scrape_if_matches_pub()
+            my_pmh_record.delete_old_record()
+            db.session.merge(my_pmh_record)
+            db.session.flush()
+            my_pmh_record.enqueue_representative_page()
+
     def safe_get_next_record(self, current_record, tries=3):
         self.error = None
         try:
@@ -493,6 +515,52 @@ def is_complete(record):
 
 
 class MyOAIItemIterator(OAIItemIterator):
+    def __init__(self, sickle, params, ignore_deleted=False):
+        self._read_ahead = None
+        super(MyOAIItemIterator, self).__init__(sickle, params, ignore_deleted)
+
+    def _next_response_params(self):
+        params = self.params
+        if self.resumption_token:
+            params = {
+                'resumptionToken': self.resumption_token.token,
+                'verb': self.verb
+            }
+        return params
+
+    def _next_response(self):
+        """Get the next response from the OAI server.
+
+        Copy-pasted from OAIItemIterator._next_response but takes the response from the read-ahead
+        if there is one, and starts the next read-ahead if the sickle has it turned on.
+        """
+        params = self._next_response_params()
+        read_ahead, self._read_ahead = self._read_ahead, None
+
+        if read_ahead and read_ahead[0] == params:
+            # raises here if the background request failed
+            self.oai_response = read_ahead[1].result()
+        else:
+            self.oai_response = self.sickle.harvest(**params)
+
+        error = self.oai_response.xml.find(
+            './/' + self.sickle.oai_namespace + 'error')
+        if error is not None:
+            code = error.attrib.get('code', 'UNKNOWN')
+            description = error.text or ''
+            try:
+                raise getattr(
+                    oaiexceptions, code[0].upper() + code[1:])(description)
+            except AttributeError:
+                raise oaiexceptions.OAIError(description)
+        self.resumption_token = self._get_resumption_token()
+        self._items = self.oai_response.xml.iterfind(
+            './/' + self.sickle.oai_namespace + self.element)
+
+        if getattr(self.sickle, 'read_ahead', False) and self.resumption_token and self.resumption_token.token:
+            next_params = self._next_response_params()
+            self._read_ahead = (next_params, self.sickle.harvest_in_background(**next_params))
+
     def _get_resumption_token(self):
         """Extract and store the resumptionToken from the last response."""
         resumption_token_element = self.oai_response.xml.find(
@@ -526,11 +594,8 @@ class MyOAIItemIterator(OAIItemIterator):
 
 
 class OSTIOAIItemIterator(MyOAIItemIterator):
-    def _next_response(self):
-        """Get the next response from the OAI server.
-
-        Copy-pasted from OAIItemIterator._next_response but adds metadataPrefix to params.
-        """
+    def _next_response_params(self):
+        # adds metadataPrefix to the resumption params
         params = self.params
         if self.resumption_token:
             params = {
@@ -538,23 +603,16 @@ class OSTIOAIItemIterator(MyOAIItemIterator):
                 'verb': self.verb,
                 'metadataPrefix': params.get('metadataPrefix')
             }
-        self.oai_response = self.sickle.harvest(**params)
-        error = self.oai_response.xml.find(
-            './/' + self.sickle.oai_namespace + 'error')
-        if error is not None:
-            code = error.attrib.get('code', 'UNKNOWN')
-            description = error.text or ''
-            try:
-                raise getattr(
-                    oaiexceptions, code[0].upper() + code[1:])(description)
-            except AttributeError:
-                raise oaiexceptions.OAIError(description)
-        self.resumption_token = self._get_resumption_token()
-        self._items = self.oai_response.xml.iterfind(
-            './/' + self.sickle.oai_namespace + self.element)
+        return params
+
 
+def _stop_read_ahead(pmh_records):
+    my_sickle = getattr(pmh_records, 'sickle', None)
+    if isinstance(my_sickle, MySickle):
+        my_sickle.stop_read_ahead()
 
-def _get_my_sickle(repo_pmh_url, timeout=120):
+
+def _get_my_sickle(repo_pmh_url, timeout=120, read_ahead=False):
     if not repo_pmh_url:
         return None
 
@@ -576,7 +634,7 @@ def _get_my_sickle(repo_pmh_url, timeout=120):
 
     iterator = OSTIOAIItemIterator if 'osti.gov/oai' in repo_pmh_url else MyOAIItemIterator
     sickle = EuropePMCSickle if 'europepmc.org' in repo_pmh_url else MySickle
-    my_sickle = sickle(repo_pmh_url, proxies=proxies, timeout=timeout, iterator=iterator)
+    my_sickle = sickle(repo_pmh_url, proxies=proxies, timeout=timeout, iterator=iterator, read_ahead=read_ahead)
     return my_sickle
 
 
@@ -584,10 +642,25 @@ def _get_my_sickle(repo_pmh_url, timeout=120):
 class MySickle(Sickle):
     RETRY_SECONDS = 120
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, read_ahead=False, **kwargs):
         self.http_response_url = None
+        self.read_ahead = read_ahead
+        self._read_ahead_executor = None
+        # keep-alive connections across resumption pages
+        self.session = requests.Session()
         super(MySickle, self).__init__(*args, **kwargs)
 
+    def harvest_in_background(self, **kwargs):
+        # one thread, so at most one page is fetched ahead
+        if self._read_ahead_executor is None:
+            self._read_ahead_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        return self._read_ahead_executor.submit(self.harvest, **kwargs)
+
+    def stop_read_ahead(self):
+        if self._read_ahead_executor is not None:
+            self._read_ahead_executor.shutdown(wait=False, cancel_futures=True)
+            self._read_ahead_executor = None
+
     def get_http_response_url(self):
         if hasattr(self, "http_response_url"):
             return self.http_response_url
@@ -615,13 +688,13 @@ class MySickle(Sickle):
             if self.http_method == 'GET':
                 payload_str = "&".join("{}={}".format(k, v) for k, v in list(kwargs.items()))
                 url_without_encoding = "{}?{}".format(self.endpoint, payload_str)
-                http_response = requests.get(url_without_encoding, headers=headers, verify=verify,
-                                             **self.request_args)
+                http_response = self.session.get(url_without_encoding, headers=headers, verify=verify,
+                                                 **self.request_args)
 
                 self.http_response_url = http_response.url
             else:
-                http_response = requests.post(self.endpoint, headers=headers, data=kwargs,
-                                              **self.request_args)
+                http_response = self.session.post(self.endpoint, headers=headers, data=kwargs,
+                                                  **self.request_args)
                 self.http_response_url = http_response.url
             if http_response.status_code == 503:
                 retry_after = int(http_response.headers.get('Retry-After', self.RETRY_SECONDS))
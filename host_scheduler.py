@@ -0,0 +1,68 @@
+import pickle
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+
+ScrapeJob = namedtuple('ScrapeJob', ['item', 'host_key', 'interval_seconds'])
+ScheduledJob = namedtuple('ScheduledJob', ['item', 'host_key', 'interval_seconds', 'not_before'])
+
+
+class HostScheduler(object):
+    """Orders a chunk of scrape jobs by when each job's host may next be scraped.
+
+    Each host key gets one start per interval_seconds, beginning from the start time its
+    rate limit key holds in redis. Jobs are returned in slot order, so the front of the list
+    is always hosts that are ready now. Jobs that couldn't start within max_wait_seconds are
+    deferred instead of making a worker sleep for them.
+    """
+
+    def __init__(self, redis_client, clock=datetime.utcnow, max_wait_seconds=60):
+        self.redis_client = redis_client
+        self.clock = clock
+        self.max_wait_seconds = max_wait_seconds
+
+    @staticmethod
+    def started_key(host_key):
+        return '{}started'.format(host_key)
+
+    def next_allowed_times(self, jobs):
+        now = self.clock()
+        intervals = {}
+        for job in jobs:
+            intervals.setdefault(job.host_key, job.interval_seconds)
+
+        host_keys = list(intervals.keys())
+        if not host_keys:
+            return {}
+
+        started_values = self.redis_client.mget([self.started_key(host_key) for host_key in host_keys])
+
+        next_allowed = {}
+        for host_key, started_value in zip(host_keys, started_values):
+            started = pickle.loads(started_value) if started_value else None
+            if started:
+                next_allowed[host_key] = max(now, started + timedelta(seconds=intervals[host_key]))
+            else:
+                next_allowed[host_key] = now
+
+        return next_allowed
+
+    def schedule(self, jobs):
+        """Returns (scheduled jobs in the order to run them, items deferred to a later chunk)."""
+        now = self.clock()
+        latest_start = now + timedelta(seconds=self.max_wait_seconds)
+        next_allowed = self.next_allowed_times(jobs)
+
+        scheduled = []
+        deferred = []
+        for index, job in enumerate(jobs):
+            slot = next_allowed[job.host_key]
+            if slot > latest_start:
+                deferred.append(job.item)
+                continue
+
+            next_allowed[job.host_key] = slot + timedelta(seconds=job.interval_seconds)
+            scheduled.append((slot, index, ScheduledJob(job.item, job.host_key, job.interval_seconds, slot)))
+
+        scheduled.sort(key=lambda s: (s[0], s[1]))
+        return [s[2] for s in scheduled], deferred
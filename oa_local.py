@@ -10,7 +10,7 @@ import urllib.request
 
 import requests
 
-from doaj import doaj_issns, doaj_titles
+from doaj import doaj_issn_index, doaj_title_index
 from app import logger
 from util import normalize_issn
 
@@ -97,16 +97,15 @@ def is_open_via_doaj_issn(issns, pub_year=None):
     if issns:
         for issn in issns:
             issn_no_hypen = issn.replace("-", "")
-            for (row_issn_no_hyphen, row_license, doaj_start_year) in doaj_issns():
-                if issn_no_hypen == row_issn_no_hyphen:
-                    if doaj_start_year and pub_year and (doaj_start_year > pub_year):
-                        pass # journal wasn't open yet!
-                    else:
-                        # logger.info(u"open: doaj issn match!")
-                        if row_license == "Publisher's own license":
-                            return "publisher-specific-oa"
-
-                        return find_normalized_license(row_license)
+            for (row_license, doaj_start_year) in doaj_issn_index().get(issn_no_hypen, []):
+                if doaj_start_year and pub_year and (doaj_start_year > pub_year):
+                    pass # journal wasn't open yet!
+                else:
+                    # logger.info(u"open: doaj issn match!")
+                    if row_license == "Publisher's own license":
+                        return "publisher-specific-oa"
+
+                    return find_normalized_license(row_license)
     return False
 
 # returns true if is in open list of issns, or doaj issns
@@ -154,15 +153,14 @@ def is_open_via_doaj_journal(all_journals, pub_year=None):
 
             journals_to_skip = doaj_titles_to_skip()
             if journal_name not in journals_to_skip:
-                for (row_journal_name, row_license, doaj_start_year) in doaj_titles():
-                    if journal_name_encoded.strip().lower() == row_journal_name.strip().lower():
-                        if doaj_start_year and pub_year and (doaj_start_year > pub_year):
-                            pass # journal wasn't open yet!
-                        else:
-                            # logger.info(u"open: doaj journal name match! {}".format(journal_name))
-                            if row_license == "Publisher's own license":
-                                return "publisher-specific-oa"
-                            return find_normalized_license(row_license)
+                for (row_license, doaj_start_year) in doaj_title_index().get(journal_name_encoded.strip().lower(), []):
+                    if doaj_start_year and pub_year and (doaj_start_year > pub_year):
+                        pass # journal wasn't open yet!
+                    else:
+                        # logger.info(u"open: doaj journal name match! {}".format(journal_name))
+                        if row_license == "Publisher's own license":
+                            return "publisher-specific-oa"
+                        return find_normalized_license(row_license)
     return False
 
 def is_open_via_datacite_prefix(doi):
@@ -1,9 +1,10 @@
 # -*- coding: utf-8 -*-
 
+import os
+import time
 from collections import defaultdict
 
 from sqlalchemy.dialects.postgresql import JSONB
-from sqlalchemy import func
 
 from app import db
 import oa_evidence
@@ -18,14 +19,45 @@ class OAManual(db.Model):
     response_jsonb = db.Column(JSONB)
 
 
-def get_override_dict(pub):
-    overrides_dict = get_overrides_dict()
-    db_overrides_dict = db.session.query(OAManual).filter(func.lower(OAManual.doi) == func.lower(pub.doi)).first()
+def db_overrides_ttl_seconds():
+    return int(os.getenv('OA_MANUAL_DB_CACHE_SECONDS', 300))
+
+
+_db_overrides = {}
+_db_overrides_loaded_at = None
+
+
+def get_db_overrides_dict():
+    # the oa_manual table is small, so keep all of it in memory and reload it every few minutes
+    global _db_overrides, _db_overrides_loaded_at
+
+    now = time.time()
+    if _db_overrides_loaded_at is None or now - _db_overrides_loaded_at > db_overrides_ttl_seconds():
+        db_overrides = {}
+        for (doi, response_jsonb) in db.session.query(OAManual.doi, OAManual.response_jsonb).order_by(OAManual.id):
+            if doi:
+                db_overrides.setdefault(doi.lower(), response_jsonb)
+
+        _db_overrides = db_overrides
+        _db_overrides_loaded_at = now
 
-    if pub.doi in overrides_dict:
-        return overrides_dict[pub.doi]
-    elif db_overrides_dict:
-        return db_overrides_dict.response_jsonb
+    return _db_overrides
+
+
+def clear_db_overrides_cache():
+    global _db_overrides_loaded_at
+    _db_overrides_loaded_at = None
+
+
+def get_override_dict(pub):
+    db_overrides_dict = {}
+    if pub.doi and pub.doi not in _static_overrides_dict:
+        db_overrides_dict = get_db_overrides_dict()
+
+    if pub.doi in _static_overrides_dict:
+        return _static_overrides_dict[pub.doi]
+    elif pub.doi and pub.doi.lower() in db_overrides_dict:
+        return db_overrides_dict[pub.doi.lower()]
     elif pub.issn_l == '0860-021X':
         # Biology of Sport.
         # ticket 995
@@ -1562,3 +1594,6 @@ def get_overrides_dict():
         response[normalize_doi(k)] = v
 
     return response
+
+
+_static_overrides_dict = get_overrides_dict()
@@ -5,6 +5,7 @@ import logging
 import os
 import time
 from argparse import ArgumentParser
+from collections import defaultdict
 from datetime import datetime
 from io import BytesIO
 from queue import Queue, Empty
@@ -12,9 +13,10 @@ from threading import Thread, Lock
 from urllib.parse import urljoin
 
 import boto3
-import botocore
 import requests
 from bs4 import BeautifulSoup
+from cachetools import LRUCache
+from psycopg2 import extras
 from requests import HTTPError
 from sqlalchemy import create_engine, text
 from tenacity import retry, stop_after_attempt, retry_if_exception_type
@@ -22,6 +24,7 @@ from tenacity import retry, stop_after_attempt, retry_if_exception_type
 from app import app, logger
 from const import GROBID_XML_BUCKET
 from pdf_util import PDFVersion
+from s3_util import check_exists
 
 OADOI_DB_ENGINE = create_engine(app.config['SQLALCHEMY_DATABASE_URI'])
 OPENALEX_DB_ENGINE = create_engine(os.getenv('OPENALEX_DATABASE_URL'))
@@ -34,7 +37,9 @@ TOTAL_ATTEMPTED = 0
 SUCCESFUL_LOCK = Lock()
 SUCCESSFUL = 0
 
-SEEN = set()
+# bounded so long runs don't grow without limit. a doi that falls out can be parsed again,
+# but pdf_update_ingest won't hand it out twice in a run anyway
+SEEN = LRUCache(maxsize=int(os.getenv('PDF_PARSE_SEEN_MAX_SIZE', 1000000)))
 SEEN_LOCK = Lock()
 
 DUPE_COUNT = 0
@@ -43,6 +48,34 @@ DUPE_COUNT_LOCK = Lock()
 ALREADY_PARSED_COUNT = 0
 ALREADY_PARSED_LOCK = Lock()
 
+DB_BATCH_SIZE = int(os.getenv('PDF_PARSE_DB_BATCH_SIZE', 500))
+DB_BATCH_MS = int(os.getenv('PDF_PARSE_DB_BATCH_MS', 1000))
+
+DB_WRITER = None
+
+# one multi-row statement per target table: (connection name, sql for execute_values)
+# every row starts with the doi, which is used to keep only the last row per doi in a batch
+BATCH_STATEMENTS = {
+    'record_fulltext': ('OPENALEX', '''
+        INSERT INTO mid.record_fulltext (recordthresher_id, fulltext)
+        SELECT DISTINCT ON (r.id) r.id, v.fulltext
+        FROM (VALUES %s) v(doi, fulltext)
+        JOIN ins.recordthresher_record r ON r.doi = v.doi AND r.record_type = 'crossref_doi'
+        ON CONFLICT (recordthresher_id) DO UPDATE SET fulltext = excluded.fulltext
+    '''),
+    'pdf_parsed': ('OADOI', '''
+        INSERT INTO recordthresher.pdf_parsed (doi, authors, abstract, "references", other)
+        VALUES %s
+        ON CONFLICT (doi) DO NOTHING
+    '''),
+    'ingest_finished': ('OADOI', '''
+        UPDATE recordthresher.pdf_update_ingest i
+        SET finished = now(), error = v.error
+        FROM (VALUES %s) v(doi, error)
+        WHERE i.doi = v.doi
+    '''),
+}
+
 libs_to_mum = [
     'boto',
     'boto3',
@@ -62,7 +95,7 @@ def inc_already_parsed():
 
 def add_to_seen(doi):
     with SEEN_LOCK:
-        SEEN.add(doi)
+        SEEN[doi] = True
 
 
 def doi_is_seen(doi):
@@ -97,11 +130,26 @@ def make_s3():
 
 
 def grobid_pdf_exists(key, s3):
+    return check_exists(GROBID_XML_BUCKET, key, s3=s3)
+
+
+def already_parsed_dois(doi_versions):
+    # check a whole chunk with s3 listings instead of a request per doi.
+    # returns None if the check failed, so workers check each doi themselves
+    dois_by_version = defaultdict(list)
+    for doi, version in doi_versions:
+        dois_by_version[version].append(doi)
+
+    already_parsed = set()
     try:
-        s3.get_object(Bucket=GROBID_XML_BUCKET, Key=key)
-        return True
-    except botocore.exceptions.ClientError as e:
-        return False
+        for version, dois in dois_by_version.items():
+            if version:
+                already_parsed.update((doi, version) for doi in version.dois_with_grobid_in_s3(dois))
+    except Exception as e:
+        logger.exception(f'error checking s3 for parsed pdfs: {e}')
+        return None
+
+    return already_parsed
 
 
 def enqueue_from_db_loop(pdf_doi_q: Queue):
@@ -121,8 +169,10 @@ def enqueue_from_db_loop(pdf_doi_q: Queue):
             rows = conn.execute(
                 text(query).execution_options(autocommit=True,
                                               autoflush=True)).all()
-            for row in rows:
-                pdf_doi_q.put((row['doi'], PDFVersion.from_version_str(row['pdf_version'])))
+            doi_versions = [(row['doi'], PDFVersion.from_version_str(row['pdf_version'])) for row in rows]
+            already_parsed = already_parsed_dois(doi_versions)
+            for doi, version in doi_versions:
+                pdf_doi_q.put((doi, version, None if already_parsed is None else (doi, version) in already_parsed))
             if not rows:
                 break
 
@@ -142,21 +192,98 @@ def decompress_raw(raw):
     return gzip.decompress(base64.decodebytes(raw.encode())).decode()
 
 
-def process_db_statements_loop(db_q: Queue):
-    oadoi_conn = OADOI_DB_ENGINE.connect()
-    openalex_conn = OPENALEX_DB_ENGINE.connect()
-    conns = {'OADOI': oadoi_conn, 'OPENALEX': openalex_conn}
-    while True:
+class BatchedStatementWriter:
+    """Drains (statement name, row) items from db_q and writes each table's rows with one statement.
+
+    A batch is flushed when it has batch_size items or batch_ms after its first item arrived.
+    If a batch fails, its rows are retried one at a time so one bad row only loses itself.
+    """
+
+    def __init__(self, db_q: Queue, batch_size=DB_BATCH_SIZE, batch_ms=DB_BATCH_MS):
+        self.db_q = db_q
+        self.batch_size = batch_size
+        self.batch_ms = batch_ms
+        self.conns = {}
+        self.flush_count = 0
+        self.rows_written = 0
+        self.last_flush_seconds = 0
+        self.total_flush_seconds = 0
+
+    def queue_depth(self):
+        return self.db_q.qsize()
+
+    def avg_flush_seconds(self):
+        return self.total_flush_seconds / self.flush_count if self.flush_count else 0
+
+    def next_batch(self):
+        # raises Empty if nothing arrives for 2 minutes
+        batch = [self.db_q.get(timeout=120)]
+        deadline = time.time() + self.batch_ms / 1000
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.db_q.get(timeout=remaining))
+            except Empty:
+                break
+        return batch
+
+    def flush(self, batch):
+        start = time.time()
+        rows_by_statement = defaultdict(dict)
+        for statement_name, row in batch:
+            if row[0] is not None:
+                rows_by_statement[statement_name][row[0]] = row
+
+        for statement_name, rows in rows_by_statement.items():
+            self.write_rows(statement_name, list(rows.values()))
+
+        self.last_flush_seconds = time.time() - start
+        self.total_flush_seconds += self.last_flush_seconds
+        self.flush_count += 1
+        self.rows_written += len(batch)
+
+    def write_rows(self, statement_name, rows):
+        conn_name, sql = BATCH_STATEMENTS[statement_name]
         try:
-            stmnt, conn_name, force_commit = db_q.get(timeout=120)
-            conns[conn_name].execute(stmnt)
-        except Empty:
-            logger.debug('Exiting process_db_statements_loop')
-            break
-        except Exception as e:
-            logger.exception("Error executing db statement", exc_info=True)
-    oadoi_conn.close()
-    openalex_conn.close()
+            self.execute_values(conn_name, sql, rows)
+        except Exception:
+            logger.exception(f'Error writing {len(rows)} {statement_name} rows, retrying one at a time')
+            for row in rows:
+                try:
+                    self.execute_values(conn_name, sql, [row])
+                except Exception:
+                    logger.exception(f'Error writing {statement_name} row for DOI: {row[0]}')
+
+    def execute_values(self, conn_name, sql, rows):
+        conn = self.conns[conn_name]
+        try:
+            with conn.cursor() as cursor:
+                extras.execute_values(cursor, sql, rows, page_size=len(rows))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    def run(self):
+        self.conns = {
+            'OADOI': OADOI_DB_ENGINE.raw_connection(),
+            'OPENALEX': OPENALEX_DB_ENGINE.raw_connection()
+        }
+        while True:
+            try:
+                batch = self.next_batch()
+            except Empty:
+                logger.debug('Exiting process_db_statements_loop')
+                break
+            self.flush(batch)
+        for conn in self.conns.values():
+            conn.close()
+
+
+def process_db_statements_loop(db_writer: BatchedStatementWriter):
+    db_writer.run()
 
 
 def save_grobid_response_loop(pdf_doi_q: Queue, db_q: Queue):
@@ -166,35 +293,31 @@ def save_grobid_response_loop(pdf_doi_q: Queue, db_q: Queue):
         doi = None
         exc = None
         try:
-            doi, version = pdf_doi_q.get(timeout=20)
+            doi, version, already_parsed = pdf_doi_q.get(timeout=20)
             if doi_is_seen(doi):
                 inc_dupe_count()
                 continue
             add_to_seen(doi)
-            if version.grobid_in_s3(doi):
+            if already_parsed is None:
+                already_parsed = version.grobid_in_s3(doi)
+            if already_parsed:
                 inc_already_parsed()
                 continue
             parsed = fetch_parsed_pdf_response(doi, version)['message']
             if parsed.get('fulltext'):
                 soup = BeautifulSoup(parsed['fulltext'], parser='lxml', features='lxml')
-                stmnt = text(
-                    '''INSERT INTO mid.record_fulltext (recordthresher_id, fulltext) SELECT r.id, :fulltext FROM (SELECT id FROM ins.recordthresher_record WHERE doi = :doi AND record_type = 'crossref_doi') r ON CONFLICT(recordthresher_id) DO UPDATE SET fulltext = :fulltext;''').bindparams(
-                        fulltext=soup.get_text(separator=' '),
-                        doi=doi)
-                db_q.put((stmnt, 'OPENALEX', False))
+                db_q.put(('record_fulltext', (doi, soup.get_text(separator=' '))))
             other_obj = {}
             for k, v in parsed.items():
                 if k not in known_keys:
                     other_obj[k] = v
-            stmnt = text(
-                'INSERT INTO recordthresher.pdf_parsed (doi, authors, abstract, "references", other) VALUES (:doi, :authors, :abstract, :references, :other) ON CONFLICT (doi) DO NOTHING').bindparams(
-                doi=doi,
-                authors=json.dumps(parsed.get('authors')),
-                abstract=parsed.get('abstract'),
-                references=json.dumps(parsed.get('references')),
-                other=json.dumps(other_obj)
-            )
-            db_q.put((stmnt, 'OADOI', False))
+            db_q.put(('pdf_parsed', (
+                doi,
+                json.dumps(parsed.get('authors')),
+                parsed.get('abstract'),
+                json.dumps(parsed.get('references')),
+                json.dumps(other_obj)
+            )))
             if raw := parsed.get('raw'):
                 gzipped = base64.decodebytes(raw.encode())
                 s3.upload_fileobj(BytesIO(gzipped), Key=version.grobid_s3_key(doi),
@@ -212,10 +335,7 @@ def save_grobid_response_loop(pdf_doi_q: Queue, db_q: Queue):
                 logger.exception('Error', exc_info=True)
         finally:
             inc_attempted()
-            stmnt = text(
-                'UPDATE recordthresher.pdf_update_ingest SET finished = now(), error = :exc WHERE doi = :doi').bindparams(
-                doi=doi, exc=str(exc))
-            db_q.put((stmnt, 'OADOI', False))
+            db_q.put(('ingest_finished', (doi, str(exc))))
 
 
 def print_stats():
@@ -228,6 +348,9 @@ def print_stats():
                             2) if TOTAL_ATTEMPTED else 0
         logger.info(
             f'Total attempted: {TOTAL_ATTEMPTED} | Successful: {SUCCESSFUL} | Success %: {success_pct} | Duplicates: {DUPE_COUNT} | Already parsed: {ALREADY_PARSED_COUNT} | Rate: {rate_per_hr}/hr')
+        if DB_WRITER:
+            logger.info(
+                f'DB queue depth: {DB_WRITER.queue_depth()} | Rows written: {DB_WRITER.rows_written} | Flushes: {DB_WRITER.flush_count} | Last flush: {round(DB_WRITER.last_flush_seconds, 3)}s | Avg flush: {round(DB_WRITER.avg_flush_seconds(), 3)}s')
         time.sleep(5)
 
 
@@ -243,13 +366,15 @@ def parse_args():
 
 
 def main():
+    global DB_WRITER
     args = parse_args()
     logger.info(f'Starting with {args.n_threads} threads')
     q = Queue(maxsize=args.n_threads + 1)
-    db_q = Queue(maxsize=args.n_threads + 1)
+    db_q = Queue(maxsize=2 * DB_BATCH_SIZE)
+    DB_WRITER = BatchedStatementWriter(db_q)
     Thread(target=print_stats, daemon=True).start()
     Thread(target=enqueue_from_db_loop, args=(q,), daemon=True).start()
-    Thread(target=process_db_statements_loop, args=(db_q,), daemon=True).start()
+    Thread(target=process_db_statements_loop, args=(DB_WRITER,), daemon=True).start()
 
     threads = []
     for _ in range(args.n_threads):
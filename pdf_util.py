@@ -7,7 +7,7 @@ from sqlalchemy import text
 from app import s3_conn, logger, db
 
 from const import PDF_ARCHIVE_BUCKET, GROBID_XML_BUCKET
-from s3_util import check_exists, get_object
+from s3_util import check_exists, existing_keys, get_object
 
 
 class PDFVersion(Enum):
@@ -43,6 +43,14 @@ class PDFVersion(Enum):
     def grobid_in_s3(self, doi):
         return check_exists(GROBID_XML_BUCKET, self.grobid_s3_key(doi))
 
+    def dois_in_s3(self, dois) -> set:
+        dois_by_key = {self.s3_key(doi): doi for doi in dois}
+        return {dois_by_key[key] for key in existing_keys(PDF_ARCHIVE_BUCKET, dois_by_key.keys())}
+
+    def dois_with_grobid_in_s3(self, dois) -> set:
+        dois_by_key = {self.grobid_s3_key(doi): doi for doi in dois}
+        return {dois_by_key[key] for key in existing_keys(GROBID_XML_BUCKET, dois_by_key.keys())}
+
     def get_grobid_xml_obj(self, doi):
         return get_object(GROBID_XML_BUCKET, self.grobid_s3_key(doi))
 
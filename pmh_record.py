@@ -4,8 +4,9 @@
 import datetime
 import html
 import re
+from collections import defaultdict
 
-from sqlalchemy import nullslast, or_, orm, text
+from sqlalchemy import func, orm, text, tuple_
 from sqlalchemy.dialects.postgresql import JSONB
 
 import page
@@ -131,6 +132,103 @@ def title_match_limit_exceptions():
     }
 
 
+class PageLookup(object):
+    """Existing pages and title match counts for the urls of a batch of PmhRecords.
+
+    Fetched with one query each, then kept up to date as the batch mints pages,
+    so later records in the batch see pages minted by earlier ones.
+    """
+
+    def __init__(self, pmh_records):
+        self.pages_by_url = defaultdict(list)
+        self.title_match_counts = defaultdict(int)
+
+        endpoint_ids = {r.endpoint_id for r in pmh_records}
+        urls = {url for r in pmh_records for url in r.get_good_urls(r.urls)}
+
+        if urls:
+            existing_pages = page.PageNew.query.filter(
+                page.PageNew.endpoint_id.in_(endpoint_ids),
+                page.PageNew.url.in_(urls)
+            ).options(orm.noload('*')).all()
+
+            for existing_page in existing_pages:
+                self.pages_by_url[(existing_page.endpoint_id, existing_page.url)].append(existing_page)
+
+        normalized_titles = {r.calc_normalized_title() for r in pmh_records} - {None, ''}
+
+        if normalized_titles:
+            title_counts = db.session.query(
+                page.RepoPage.normalized_title, func.count(page.RepoPage.id)
+            ).filter(
+                page.RepoPage.match_title == True,
+                page.RepoPage.normalized_title.in_(normalized_titles)
+            ).group_by(page.RepoPage.normalized_title).all()
+
+            self.title_match_counts.update(title_counts)
+
+    def existing_page(self, page_class, endpoint_id, url, normalized_title):
+        match_type = page_class.__mapper_args__["polymorphic_identity"]
+        for existing_page in self.pages_by_url[(endpoint_id, url)]:
+            if existing_page.match_type == match_type and existing_page.normalized_title == normalized_title:
+                return existing_page
+        return None
+
+    def most_recent_page(self, endpoint_id, url):
+        url_pages = self.pages_by_url[(endpoint_id, url)]
+        scraped_pages = [p for p in url_pages if p.scrape_updated]
+        if scraped_pages:
+            return max(scraped_pages, key=lambda p: p.scrape_updated)
+        return url_pages[0] if url_pages else None
+
+    def title_match_count(self, normalized_title):
+        return self.title_match_counts[normalized_title]
+
+    def add_page(self, minted_page, new_title_match=False):
+        url_pages = self.pages_by_url[(minted_page.endpoint_id, minted_page.url)]
+        if not any(p is minted_page for p in url_pages):
+            url_pages.append(minted_page)
+
+        if new_title_match:
+            self.title_match_counts[minted_page.normalized_title] += 1
+
+
+def mint_pages_for_records(pmh_records, reset_scrape_date=False):
+    # PmhRecord.mint_pages for a batch of records. Existing pages, title counts, stale page deletes
+    # and queue resets each take one query for the whole batch instead of a few per url.
+    # returns each record's pages, in order
+    mintable_records = [r for r in pmh_records if r.can_mint_pages()]
+    page_lookup = PageLookup(mintable_records)
+
+    for pmh_record in mintable_records:
+        pmh_record.mint_pages_from_lookup(page_lookup)
+
+    minted_pages = [p for r in mintable_records for p in r.pages]
+
+    if mintable_records:
+        # delete pages with these pmh_ids that aren't being updated
+        stale_page_keys = list({(r.endpoint_id, pmh_id) for r in mintable_records for pmh_id in [r.id, r.pmh_id] if pmh_id})
+        db.session.query(page.PageNew).filter(
+            tuple_(page.PageNew.endpoint_id, page.PageNew.pmh_id).in_(stale_page_keys),
+            page.PageNew.id.notin_([p.id for p in minted_pages])
+        ).delete(synchronize_session=False)
+
+    if reset_scrape_date and minted_pages:
+        # move already queued-pages at the front of the queue
+        # if the record was updated the oa status might have changed
+        query_text = '''
+            update page_green_scrape_queue
+            set finished = null
+            where id = any(:ids) and started is null
+        '''
+
+        reset_query = text(query_text).bindparams(ids=[p.id for p in minted_pages])
+
+        db.session.execute(reset_query)
+
+    return [r.pages if r.can_mint_pages() else [] for r in pmh_records]
+
+
 class PmhRecord(db.Model):
     id = db.Column(db.Text, primary_key=True)
     repo_id = db.Column(db.Text) # delete once endpoint_ids are all populated
@@ -576,16 +674,11 @@ class PmhRecord(db.Model):
         valid_urls = list(set(valid_urls))
         return valid_urls
 
-    def mint_repo_page_for_url(self, url):
-        my_repo_page = self.mint_page_for_url(page.RepoPage, url)
+    def mint_repo_page_for_url(self, url, page_lookup):
+        my_repo_page = self.mint_page_for_url(page.RepoPage, url, page_lookup)
 
         # get the most recent scrape data
-        most_recent_old_page = page.PageNew.query.filter(
-            page.PageNew.endpoint_id == self.endpoint_id,
-            page.PageNew.url == url
-        ).order_by(
-            nullslast(page.PageNew.scrape_updated.desc())
-        ).options(orm.noload('*')).first()
+        most_recent_old_page = page_lookup.most_recent_page(self.endpoint_id, url)
 
         if most_recent_old_page:
             my_repo_page.scrape_updated = most_recent_old_page.scrape_updated
@@ -596,14 +689,8 @@ class PmhRecord(db.Model):
 
         return my_repo_page
 
-    def mint_page_for_url(self, page_class, url):
-        from page import PageNew
-        # this is slow, but no slower than looking for titles before adding pages
-        existing_page = PageNew.query.filter(PageNew.normalized_title==self.calc_normalized_title(),
-                                             PageNew.match_type==page_class.__mapper_args__["polymorphic_identity"],
-                                             PageNew.url==url,
-                                             PageNew.endpoint_id==self.endpoint_id
-                                             ).options(orm.noload('*')).first()
+    def mint_page_for_url(self, page_class, url, page_lookup):
+        existing_page = page_lookup.existing_page(page_class, self.endpoint_id, url, self.calc_normalized_title())
         if existing_page:
             my_page = existing_page
         else:
@@ -651,16 +738,23 @@ class PmhRecord(db.Model):
             PmhRecord.id == self.bare_pmh_id, PmhRecord.endpoint_id == self.endpoint_id
         ).delete()
 
-    def mint_pages(self, reset_scrape_date=False):
+    def can_mint_pages(self):
         if self.endpoint_id == 'ac9de7698155b820de7':
             # NIH PMC. Don't mint pages because we use a CSV dump to make OA locations. See Pub.ask_pmc
-            return []
+            return False
 
         if self.bare_pmh_id and self.bare_pmh_id.startswith('oai:openarchive.ki.se:'):
             # ticket 22247, only type=art can match DOIs
             if '<dc:type>art</dc:type>' not in self.api_raw:
-                return []
+                return False
+
+        return True
+
+    def mint_pages(self, reset_scrape_date=False):
+        return mint_pages_for_records([self], reset_scrape_date=reset_scrape_date)[0]
 
+    def mint_pages_from_lookup(self, page_lookup):
+        # stale page deletes and queue resets are left to mint_pages_for_records
         self.pages = []
 
         # this should have already been done when setting .urls, but do it again in case there were improvements
@@ -671,17 +765,15 @@ class PmhRecord(db.Model):
             logger.info('found limited access label, not minting pages')
         else:
             for url in good_urls:
-                my_repo_page = self.mint_repo_page_for_url(url)
+                my_repo_page = self.mint_repo_page_for_url(url, page_lookup)
+                was_title_match = bool(my_repo_page.match_title)
 
                 if self.doi:
                     my_repo_page.match_doi = True
 
                 normalized_title = self.calc_normalized_title()
                 if normalized_title:
-                    num_pages_with_this_normalized_title = db.session.query(page.RepoPage.id).filter(
-                        page.RepoPage.match_title == True,
-                        page.RepoPage.normalized_title == normalized_title
-                    ).count()
+                    num_pages_with_this_normalized_title = page_lookup.title_match_count(normalized_title)
 
                     if num_pages_with_this_normalized_title >= 20 and normalized_title not in title_match_limit_exceptions():
                         logger.info("not allowing title matches because too many with this title: {}".format(normalized_title))
@@ -691,30 +783,11 @@ class PmhRecord(db.Model):
                     else:
                         my_repo_page.match_title = True
 
+                page_lookup.add_page(my_repo_page, new_title_match=my_repo_page.match_title and not was_title_match)
                 self.pages.append(my_repo_page)
 
             # logger.info(u"minted pages: {}".format(self.pages))
 
-        # delete pages with this pmh_id that aren't being updated
-        db.session.query(page.PageNew).filter(
-            page.PageNew.endpoint_id == self.endpoint_id,
-            or_(page.PageNew.pmh_id == self.id, page.PageNew.pmh_id == self.pmh_id),
-            page.PageNew.id.notin_([p.id for p in self.pages])
-        ).delete(synchronize_session=False)
-
-        if reset_scrape_date and self.pages:
-            # move already queued-pages at the front of the queue
-            # if the record was updated the oa status might have changed
-            query_text = '''
-                update page_green_scrape_queue
-                set finished = null
-                where id = any(:ids) and started is null
-            '''
-
-            reset_query = text(query_text).bindparams(ids=[p.id for p in self.pages])
-
-            db.session.execute(reset_query)
-
         return self.pages
 
     def enqueue_representative_page(self):
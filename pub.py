@@ -1,18 +1,22 @@
 import datetime
 import gzip
-import json
+import os
 import random
 import re
+import threading
 import urllib.parse
 from collections import Counter
 from collections import OrderedDict
 from collections import defaultdict
+from collections import namedtuple
+from contextlib import contextmanager
 from enum import Enum
 from threading import Thread
 
 import boto3
 import dateutil.parser
 import requests
+from cachetools import LRUCache
 from dateutil.relativedelta import relativedelta
 from lxml import etree
 from psycopg2.errors import UniqueViolation
@@ -41,6 +45,7 @@ from pmh_record import title_is_too_common
 from pmh_record import title_is_too_short
 from recordthresher.record_maker import CrossrefRecordMaker
 from reported_noncompliant_copies import reported_noncompliant_url_fragments
+from response_cache import invalidate_cached_response
 from util import NoDoiException
 from util import is_pmc, clamp, clean_doi, normalize_doi
 from convert_http_to_https import fix_url_scheme
@@ -61,7 +66,7 @@ def build_new_pub(doi, crossref_api):
     return my_pub
 
 
-def add_new_pubs(pubs_to_commit):
+def add_new_pubs(pubs_to_commit, raise_on_commit_error=False):
     if not pubs_to_commit:
         return []
 
@@ -83,7 +88,8 @@ def add_new_pubs(pubs_to_commit):
     if pubs_to_add_to_db:
         logger.info("adding {} pubs".format(len(pubs_to_add_to_db)))
         db.session.add_all(pubs_to_add_to_db)
-        safe_commit(db)
+        if not safe_commit(db) and raise_on_commit_error:
+            raise RuntimeError('failed committing {} new pubs'.format(len(pubs_to_add_to_db)))
         db.session.execute(
             text(
                 '''
@@ -94,7 +100,8 @@ def add_new_pubs(pubs_to_commit):
                 '''
             ).bindparams(dois=[p.id for p in pubs_to_add_to_db])
         )
-        safe_commit(db)
+        if not safe_commit(db) and raise_on_commit_error:
+            raise RuntimeError('failed queueing {} new pubs'.format(len(pubs_to_add_to_db)))
     return pubs_to_add_to_db
 
 
@@ -144,42 +151,46 @@ def lookup_product_by_doi(doi):
     return lookup_product(**biblio)
 
 
+# map unregistered JSTOR DOIs to real articles
+# for example https://www.jstor.org/stable/2244328?seq=1 says 10.2307/2244328 on the page
+# but https://doi.org/10.2307/2244328 goes nowhere and the article is at https://doi.org/10.1214/aop/1176990626
+_jstor_doi_overrides = {
+    '10.2307/2244328': '10.1214/aop/1176990626',
+    # https://www.jstor.org/stable/2244328
+    '10.2307/25151720': '10.1287/moor.1060.0190',
+    # https://www.jstor.org/stable/25151720
+    '10.2307/2237638': '10.1214/aoms/1177704711',
+    # https://www.jstor.org/stable/2237638
+}
+
+_other_doi_overrides = {
+    # these seem to be the same thing but the first one doesn't work
+    # https://api.crossref.org/v1/works/http://dx.doi.org/10.3402/qhw.v1i3.4932
+    # https://api.crossref.org/v1/works/http://dx.doi.org/10.1080/17482620600881144
+    '10.3402/qhw.v1i3.4932': '10.1080/17482620600881144',
+}
+
+
+def lookup_dois(doi):
+    """The pub ids to try for a requested DOI, in order."""
+    doi = normalize_doi(doi)
+    doi = _jstor_doi_overrides.get(
+        doi,
+        _other_doi_overrides.get(doi, doi)
+    )
+    # try cleaning DOI further
+    return [doi, clean_doi(doi)]
+
+
 def lookup_product(**biblio):
     my_pub = None
     if "doi" in biblio and biblio["doi"]:
-        doi = normalize_doi(biblio["doi"])
-
-        # map unregistered JSTOR DOIs to real articles
-        # for example https://www.jstor.org/stable/2244328?seq=1 says 10.2307/2244328 on the page
-        # but https://doi.org/10.2307/2244328 goes nowhere and the article is at https://doi.org/10.1214/aop/1176990626
-
-        jstor_overrides = {
-            '10.2307/2244328': '10.1214/aop/1176990626',
-            # https://www.jstor.org/stable/2244328
-            '10.2307/25151720': '10.1287/moor.1060.0190',
-            # https://www.jstor.org/stable/25151720
-            '10.2307/2237638': '10.1214/aoms/1177704711',
-            # https://www.jstor.org/stable/2237638
-        }
-
-        other_overrides = {
-            # these seem to be the same thing but the first one doesn't work
-            # https://api.crossref.org/v1/works/http://dx.doi.org/10.3402/qhw.v1i3.4932
-            # https://api.crossref.org/v1/works/http://dx.doi.org/10.1080/17482620600881144
-            '10.3402/qhw.v1i3.4932': '10.1080/17482620600881144',
-        }
-
-        doi = jstor_overrides.get(
-            doi,
-            other_overrides.get(doi, doi)
-        )
+        doi, cleaned_doi = lookup_dois(biblio["doi"])
 
         my_pub = Pub.query.get(doi)
 
         if not my_pub:
-            # try cleaning DOI further
-            doi = clean_doi(doi)
-            my_pub = Pub.query.get(doi)
+            my_pub = Pub.query.get(cleaned_doi)
             if not my_pub:
                 raise NoDoiException
 
@@ -209,6 +220,37 @@ def get_pubs_from_biblio(biblios, run_with_hybrid=False):
     return returned_pubs
 
 
+def last_refresh_time(pub_id):
+    """When the pub's response was last recomputed by Pub.refresh, from pub_refresh_result."""
+    return db.session.execute(
+        text(f'select max(refresh_time) from {PubRefreshResult.__tablename__} where id = :id'),
+        {'id': pub_id}
+    ).scalar()
+
+
+def get_pub_from_doi_with_stored_response(doi, run_with_hybrid=False, max_response_age=None):
+    """Like get_pub_from_biblio, but reads the results back from the stored response if it's fresh.
+
+    A response is fresh if Pub.refresh recomputed it within max_response_age. Pub.updated isn't
+    used for this because it only moves when the response changes, so it says nothing about how
+    recently a stable response was checked.
+    """
+    my_pub = lookup_product(doi=doi)
+
+    if run_with_hybrid:
+        my_pub.run_with_hybrid()
+        safe_commit(db)
+        return my_pub
+
+    refreshed = max_response_age and my_pub.response_jsonb and last_refresh_time(my_pub.id)
+    if refreshed and refreshed > datetime.datetime.utcnow() - max_response_age:
+        my_pub.load_results_from_response()
+    else:
+        my_pub.recalculate()
+
+    return my_pub
+
+
 def get_pub_from_biblio(biblio, run_with_hybrid=False, skip_all_hybrid=False,
                         recalculate=True):
     my_pub = lookup_product(**biblio)
@@ -382,6 +424,72 @@ class IssnlLookup(db.Model):
     journal_id = db.Column(db.Text)
 
 
+IssnlMatch = namedtuple('IssnlMatch', ['issn', 'issn_l', 'journal_id'])
+
+# issn -> IssnlMatch, or None for issns known not to have an issn_l
+_issn_l_cache = LRUCache(maxsize=int(os.getenv('ISSN_L_CACHE_SIZE', 200000)))
+_issn_l_cache_lock = threading.Lock()
+_issn_l_lookup_state = threading.local()
+
+
+def resolve_issn_ls(issns):
+    issns = set(issn for issn in issns or [] if issn)
+
+    resolved = {}
+    with _issn_l_cache_lock:
+        for issn in issns:
+            if issn in _issn_l_cache:
+                resolved[issn] = _issn_l_cache[issn]
+
+    uncached_issns = list(issns - set(resolved.keys()))
+    if uncached_issns:
+        rows = db.session.execute(
+            text(f'select issn, issn_l, journal_id from {IssnlLookup.__tablename__} where issn = any(:issns)'),
+            {'issns': uncached_issns}
+        ).fetchall()
+
+        for issn in uncached_issns:
+            resolved[issn] = None
+        for row in rows:
+            resolved[row.issn] = IssnlMatch(issn=row.issn, issn_l=row.issn_l, journal_id=row.journal_id)
+
+        with _issn_l_cache_lock:
+            for issn in uncached_issns:
+                _issn_l_cache[issn] = resolved[issn]
+
+    return resolved
+
+
+def prefetch_issn_ls(pubs_or_crossref_items):
+    # resolve the issns of many pubs or raw crossref works with one query
+    issns = []
+    for item in pubs_or_crossref_items or []:
+        if isinstance(item, Pub):
+            issns.extend(item.issns or [])
+        elif isinstance(item, dict):
+            issns.extend(item.get('ISSN') or [])
+
+    return resolve_issn_ls(issns)
+
+
+def set_issn_ls(pubs):
+    prefetch_issn_ls(pubs)
+    for my_pub in pubs:
+        my_pub.set_issn_l()
+
+
+@contextmanager
+def deferred_issn_l_lookups():
+    # pubs built or loaded inside this block skip the issn_l lookup.
+    # call set_issn_ls on them afterwards to resolve them all at once.
+    was_deferred = getattr(_issn_l_lookup_state, 'deferred', False)
+    _issn_l_lookup_state.deferred = True
+    try:
+        yield
+    finally:
+        _issn_l_lookup_state.deferred = was_deferred
+
+
 class JournalOaStartYear(db.Model):
     __tablename__ = 'journal_oa_start_year_patched'
 
@@ -430,6 +538,9 @@ class FilteredPreprint(db.Model):
                                                   self.postprint_id)
 
 
+RefreshPrefetch = namedtuple('RefreshPrefetch', ['skip_refresh', 'refresh_time'])
+
+
 class PubRefreshResult(db.Model):
     id = db.Column(db.Text, primary_key=True)
     refresh_time = db.Column(db.DateTime, primary_key=True)
@@ -540,7 +651,16 @@ class Pub(db.Model):
         self.closed_urls = []
         self.session_id = None
         self.version = None
+        self.refresh_prefetch = None
+        self.clear_location_cache()
+
+        if getattr(_issn_l_lookup_state, 'deferred', False):
+            self.issn_l = None
+            self.openalex_journal_id = None
+        else:
+            self.set_issn_l()
 
+    def set_issn_l(self):
         issn_l_lookup = self.lookup_issn_l()
         self.issn_l = issn_l_lookup.issn_l if issn_l_lookup else None
         self.openalex_journal_id = issn_l_lookup.journal_id if issn_l_lookup else None
@@ -692,8 +812,26 @@ class Pub(db.Model):
                 return False
             return True
 
+    def prefetch_refresh(self, session_id=None):
+        # the network part of refresh(): the parseland check and the publisher landing page scrape.
+        # doesn't use db.session, so DbQueue can run it in worker threads and then call refresh() in order
+        skip_refresh = bool(self.do_not_refresh()) and self.resolved_doi_http_status is not None
+        self.refresh_prefetch = RefreshPrefetch(skip_refresh=skip_refresh, refresh_time=datetime.datetime.utcnow())
+
+        if not skip_refresh:
+            self.session_id = session_id or get_session_id()
+            self.refresh_hybrid_scrape()
+
     def refresh(self, session_id=None):
-        if self.do_not_refresh() and self.resolved_doi_http_status is not None:
+        if not self.refresh_prefetch:
+            if self.url:
+                # end the session before the scrape
+                db.session.close()
+            self.prefetch_refresh(session_id)
+
+        refresh_prefetch, self.refresh_prefetch = self.refresh_prefetch, None
+
+        if refresh_prefetch.skip_refresh:
             logger.info(
                 f"not refreshing {self.id} because it's already gold or hybrid. Updating record thresher.")
             self.store_or_remove_pdf_urls_for_validation()
@@ -702,17 +840,18 @@ class Pub(db.Model):
             db.session.merge(self)
             return
 
-        self.session_id = session_id or get_session_id()
         refresh_result = PubRefreshResult(
             id=self.id,
-            refresh_time=datetime.datetime.utcnow(),
+            refresh_time=refresh_prefetch.refresh_time,
             oa_status_before=self.response_jsonb and self.response_jsonb.get(
                 'oa_status', None)
         )
 
         # self.refresh_green_locations()
 
-        self.refresh_hybrid_scrape()
+        if self.url:
+            # now merge our object back in
+            db.session.merge(self)
 
         # and then recalculate everything, so can do to_dict() after this and it all works
         self.update()
@@ -772,16 +911,51 @@ class Pub(db.Model):
         return ["z_authors", "oa_locations_embargoed"]
 
     @staticmethod
-    def remove_response_keys(jsonb_response, keys):
-        response_copy = json.loads(json.dumps(jsonb_response))
+    def is_ignorable_response_value(value):
+        # ignored keys are skipped at any depth when they hold a scalar or an empty list,
+        # but a nested object or non-empty list under an ignored key is still compared
+        return value is None or value == [] or isinstance(value, (str, int, float, bool))
 
-        for key in keys:
-            try:
-                del response_copy[key]
-            except KeyError:
-                pass
+    @staticmethod
+    def response_diff(new_response, old_response, ignored_keys, ignored_top_level_keys):
+        """Return the dotted paths that differ between two api responses, e.g. ['oa_locations.0.url']."""
+        changed_paths = []
+        Pub._diff_response_values(
+            new_response, old_response, [], set(ignored_keys), set(ignored_top_level_keys), changed_paths
+        )
+        return changed_paths
+
+    @staticmethod
+    def _diff_response_values(new_value, old_value, path, ignored_keys, ignored_top_level_keys, changed_paths):
+        if isinstance(new_value, dict) and isinstance(old_value, dict):
+            def comparable_keys(d):
+                return set(
+                    k for k, v in d.items()
+                    if not (not path and k in ignored_top_level_keys)
+                    and not (k in ignored_keys and Pub.is_ignorable_response_value(v))
+                )
 
-        return response_copy
+            new_keys = comparable_keys(new_value)
+            old_keys = comparable_keys(old_value)
+
+            for key in sorted(new_keys ^ old_keys):
+                changed_paths.append('.'.join(path + [key]))
+
+            for key in sorted(new_keys & old_keys):
+                Pub._diff_response_values(
+                    new_value[key], old_value[key], path + [key], ignored_keys, ignored_top_level_keys, changed_paths
+                )
+        elif isinstance(new_value, (list, tuple)) and isinstance(old_value, (list, tuple)):
+            if len(new_value) != len(old_value):
+                changed_paths.append('.'.join(path))
+            else:
+                for index, (new_item, old_item) in enumerate(zip(new_value, old_value)):
+                    Pub._diff_response_values(
+                        new_item, old_item, path + [str(index)], ignored_keys, ignored_top_level_keys, changed_paths
+                    )
+        elif type(new_value) is not type(old_value) or new_value != old_value:
+            # compare types too so that True != 1 and 1 != 1.0, like their json forms
+            changed_paths.append('.'.join(path))
 
     def has_changed(self, old_response_jsonb, ignored_keys,
                     ignored_top_level_keys):
@@ -790,44 +964,12 @@ class Pub(db.Model):
                 "response for {} has changed: no old response".format(self.id))
             return True
 
-        copy_of_new_response = Pub.remove_response_keys(self.response_jsonb,
-                                                        ignored_top_level_keys)
-        copy_of_old_response = Pub.remove_response_keys(old_response_jsonb,
-                                                        ignored_top_level_keys)
-
-        # have to sort to compare
-        copy_of_new_response_in_json = json.dumps(copy_of_new_response,
-                                                  sort_keys=True, indent=2)
-        # have to sort to compare
-        copy_of_old_response_in_json = json.dumps(copy_of_old_response,
-                                                  sort_keys=True, indent=2)
-
-        for key in ignored_keys:
-            # remove it
-            copy_of_new_response_in_json = re.sub(
-                r'"{}":\s*".+?",?\s*'.format(key), '',
-                copy_of_new_response_in_json)
-            copy_of_old_response_in_json = re.sub(
-                r'"{}":\s*".+?",?\s*'.format(key), '',
-                copy_of_old_response_in_json)
-
-            # also remove it if it is an empty list
-            copy_of_new_response_in_json = re.sub(
-                r'"{}":\s*\[\],?\s*'.format(key), '',
-                copy_of_new_response_in_json)
-            copy_of_old_response_in_json = re.sub(
-                r'"{}":\s*\[\],?\s*'.format(key), '',
-                copy_of_old_response_in_json)
-
-            # also anything till a comma (gets data_standard)
-            copy_of_new_response_in_json = re.sub(
-                r'"{}":\s*.+?,\s*'.format(key), '',
-                copy_of_new_response_in_json)
-            copy_of_old_response_in_json = re.sub(
-                r'"{}":\s*.+?,\s*'.format(key), '',
-                copy_of_old_response_in_json)
-
-        return copy_of_new_response_in_json != copy_of_old_response_in_json
+        changed_paths = Pub.response_diff(self.response_jsonb, old_response_jsonb,
+                                          ignored_keys, ignored_top_level_keys)
+        if changed_paths:
+            logger.info("response for {} has changed at {}".format(self.id, changed_paths[:10]))
+
+        return bool(changed_paths)
 
     def update(self):
         return self.recalculate_and_store()
@@ -862,6 +1004,11 @@ class Pub(db.Model):
         self.store_retractions()
         response_changed = self.decide_if_response_changed(old_response_jsonb)
 
+        if response_changed:
+            invalidate_cached_response(self.id)
+
+        return response_changed
+
     def decide_if_response_changed(self, old_response_jsonb):
         response_changed = False
 
@@ -1025,7 +1172,10 @@ class Pub(db.Model):
         self.version = None
         self.evidence = None
 
-        reversed_sorted_locations = self.sorted_locations
+        # locations may have been added since they were last sorted
+        self.clear_location_cache()
+
+        reversed_sorted_locations = list(self.sorted_locations)
         reversed_sorted_locations.reverse()
 
         # go through all the locations, using valid ones to update the best open url data
@@ -1051,9 +1201,32 @@ class Pub(db.Model):
             self.oa_status = OAStatus.closed
             self.version = None
 
+    def load_results_from_response(self):
+        # what decide_if_open would find, read back from the stored response
+        best_location = self.response_jsonb.get('best_oa_location', None) or {}
+        self.free_pdf_url = best_location.get('url_for_pdf', None)
+        self.free_metadata_url = best_location.get('url_for_landing_page', None)
+        self.evidence = best_location.get('evidence', None) or None
+        self.version = best_location.get('version', None)
+        self.license = best_location.get('license', None)
+        oa_status = self.response_jsonb.get('oa_status', None)
+        self.oa_status = OAStatus(oa_status) if oa_status else OAStatus.closed
+
     def clear_locations(self):
         self.reset_vars()
 
+    def clear_location_cache(self):
+        # derived location views, built at most once per recalculation
+        self._location_cache = {}
+
+    def cached_locations(self, key, build_locations):
+        if not hasattr(self, '_location_cache'):
+            self._location_cache = {}
+        if key not in self._location_cache:
+            self._location_cache[key] = build_locations()
+        # hand out a copy so callers can reorder it without touching the cache
+        return list(self._location_cache[key])
+
     @property
     def has_hybrid(self):
         return any([location.oa_status is OAStatus.hybrid for location in
@@ -1092,18 +1265,10 @@ class Pub(db.Model):
                                   session_id=self.session_id,
                                   issn_l=self.issn_l) as publisher_landing_page:
 
-                # end the session before the scrape
-                # logger.info(u"closing session for {}".format(self.doi))
-                db.session.close()
-
                 self.scrape_page_for_open_location(publisher_landing_page)
                 self.resolved_doi_url = publisher_landing_page.resolved_url
                 self.resolved_doi_http_status = publisher_landing_page.resolved_http_status_code
 
-                # now merge our object back in
-                # logger.info(u"after scrape, merging {}".format(self.doi))
-                db.session.merge(self)
-
                 self.save_landing_page_text(publisher_landing_page.page_text)
                 save_pdf(self.doi, publisher_landing_page.pdf_content)
 
@@ -2059,6 +2224,9 @@ class Pub(db.Model):
 
     @property
     def deduped_sorted_locations(self):
+        return self.cached_locations('deduped_sorted', self.build_deduped_sorted_locations)
+
+    def build_deduped_sorted_locations(self):
         locations = []
         sorted_locations = self.sorted_locations
 
@@ -2084,14 +2252,18 @@ class Pub(db.Model):
                 0].metadata_url:
                 publisher_no_pdf[0].pdf_url = publisher_pdf[0].pdf_url
 
+        urls_so_far = set()
         for next_location in sorted_locations:
-            urls_so_far = [location.best_url for location in locations]
             if next_location.best_url not in urls_so_far:
+                urls_so_far.add(next_location.best_url)
                 locations.append(next_location)
         return locations
 
     @property
     def filtered_locations(self):
+        return self.cached_locations('filtered', self.build_filtered_locations)
+
+    def build_filtered_locations(self):
         locations = self.open_locations
 
         # now remove noncompliant ones
@@ -2119,6 +2291,9 @@ class Pub(db.Model):
 
     @property
     def sorted_locations(self):
+        return self.cached_locations('sorted', self.build_sorted_locations)
+
+    def build_sorted_locations(self):
         locations = self.filtered_locations
         # first sort by best_url so ties are handled consistently
         locations = sorted(locations, key=lambda x: x.best_url, reverse=False)
@@ -2134,10 +2309,12 @@ class Pub(db.Model):
             return 1
 
     def lookup_issn_l(self):
-        for issn in self.issns or []:
+        issns = self.issns or []
+        lookups = resolve_issn_ls(issns) if issns else {}
+        for issn in issns:
             # use the first issn that matches an issn_l
             # can't really do anything if they would match different issn_ls
-            lookup = db.session.query(IssnlLookup).get(issn)
+            lookup = lookups.get(issn)
             if lookup:
                 return lookup
 
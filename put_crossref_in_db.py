@@ -1,6 +1,9 @@
 import argparse
+import concurrent.futures
 import datetime
 import os
+from collections import namedtuple
+from functools import partial
 from threading import Thread
 from time import time, sleep
 from urllib.parse import quote
@@ -17,6 +20,7 @@ from app import logging
 from pub import Pub
 from pub import add_new_pubs
 from pub import build_new_pub
+from util import chunks
 from util import elapsed
 from util import normalize_doi
 from util import safe_commit
@@ -29,6 +33,17 @@ from endpoint import Endpoint  # magic
 # https://github.com/CrossRef/rest-api-doc/blob/master/rest_api.md#deep-paging-with-cursors
 
 CROSSREF_API_KEY = os.getenv('CROSSREF_API_KEY')
+CROSSREF_API_URL = os.getenv('CROSSREF_API_URL', 'https://api.crossref.org')
+
+
+class CrossrefIngestCheckpoint(db.Model):
+    # see sql/crossref_ingest_checkpoint.sql
+    __tablename__ = 'crossref_ingest_checkpoint'
+
+    partition_key = db.Column(db.Text, primary_key=True)
+    next_cursor = db.Column(db.Text)
+    done = db.Column(db.Boolean, default=False)
+    updated = db.Column(db.DateTime)
 
 
 def is_good_file(filename):
@@ -74,7 +89,7 @@ def add_new_pubs_from_dois(dois):
     return added_pubs
 
 
-def add_pubs_or_update_crossref(pubs):
+def add_pubs_or_update_crossref(pubs, raise_on_commit_error=False):
     if not pubs:
         return []
 
@@ -107,7 +122,8 @@ def add_pubs_or_update_crossref(pubs):
         ).bindparams(dois=list(set(pubs_by_id.keys())))
     )
 
-    safe_commit(db)
+    if not safe_commit(db) and raise_on_commit_error:
+        raise RuntimeError('failed committing {} crossref pubs'.format(len(pubs)))
     return pubs_to_add
 
 
@@ -130,7 +146,7 @@ def get_response_page(url):
     return r
 
 
-def get_dois_and_data_from_crossref(query_doi=None, first=None, last=None, today=False, week=False, now=False, offset_days=0, chunk_size=1000, get_updates=False):
+def get_dois_and_data_from_crossref(query_doi=None, first=None, last=None, today=False, week=False, now=False, offset_days=0, chunk_size=1000, get_updates=False, partitions=None, concurrency=4, ignore_checkpoints=False):
     root_url_doi = "https://api.crossref.org/works?filter=doi:{doi}"
 
     if get_updates:
@@ -165,6 +181,19 @@ def get_dois_and_data_from_crossref(query_doi=None, first=None, last=None, today
 
     insert_pub_fn = add_pubs_or_update_crossref if get_updates else add_new_pubs
 
+    if partitions and not query_doi:
+        last = last or datetime.date.today() + datetime.timedelta(days=1)
+        return ingest_crossref_partitions(
+            date_partitions(first, last, partitions),
+            concurrency=concurrency,
+            # a page that didn't commit must not be checkpointed past
+            insert_pub_fn=partial(insert_pub_fn, raise_on_commit_error=True),
+            checkpoints=CrossrefCheckpoints(),
+            get_updates=get_updates,
+            chunk_size=chunk_size,
+            ignore_checkpoints=ignore_checkpoints
+        )
+
     while has_more_responses:
         if query_doi:
             url = root_url_doi.format(doi=query_doi)
@@ -235,6 +264,161 @@ def get_dois_and_data_from_crossref(query_doi=None, first=None, last=None, today
         num_pubs_added_so_far, datetime.datetime.now().isoformat()[0:10], elapsed(start_time, 2)))
 
 
+CrossrefPartition = namedtuple('CrossrefPartition', ['first', 'last'])
+
+
+def date_partitions(first, last, num_partitions):
+    """Splits the days from first through last into up to num_partitions contiguous ranges."""
+    num_days = (last - first).days + 1
+    num_partitions = max(1, min(num_partitions, num_days))
+
+    partitions = []
+    partition_first = first
+    for i in range(num_partitions):
+        # spread the remainder over the first partitions
+        partition_days = num_days // num_partitions + (1 if i < num_days % num_partitions else 0)
+        partition_last = partition_first + datetime.timedelta(days=partition_days - 1)
+        partitions.append(CrossrefPartition(partition_first, partition_last))
+        partition_first = partition_last + datetime.timedelta(days=1)
+
+    return partitions
+
+
+def partition_key(partition, get_updates):
+    date_type = 'index' if get_updates else 'created'
+    return '{}:{}:{}'.format(date_type, partition.first.isoformat(), partition.last.isoformat())
+
+
+def crossref_partition_url(partition, next_cursor, chunk_size, get_updates, api_url=CROSSREF_API_URL):
+    date_type = 'index' if get_updates else 'created'
+    sort = 'indexed' if get_updates else 'updated'
+    return '{api_url}/works?order=desc&sort={sort}&filter=from-{date_type}-date:{first},until-{date_type}-date:{last}&rows={chunk}&cursor={cursor}'.format(
+        api_url=api_url,
+        sort=sort,
+        date_type=date_type,
+        first=partition.first.isoformat(),
+        last=partition.last.isoformat(),
+        chunk=chunk_size,
+        cursor=quote(next_cursor)
+    )
+
+
+class CrossrefCheckpoints(object):
+    """Where each partition's cursor got to, kept in crossref_ingest_checkpoint so a restarted run can resume."""
+
+    def load(self, key):
+        checkpoint = CrossrefIngestCheckpoint.query.get(key)
+        return checkpoint and (checkpoint.next_cursor, checkpoint.done)
+
+    def save(self, key, next_cursor, done):
+        db.session.merge(CrossrefIngestCheckpoint(
+            partition_key=key,
+            next_cursor=next_cursor,
+            done=done,
+            updated=datetime.datetime.utcnow()
+        ))
+        safe_commit(db)
+
+
+def ingest_crossref_partition(partition, insert_pub_fn, checkpoints, get_updates=False, chunk_size=1000,
+                              api_url=CROSSREF_API_URL, seconds_between_requests=1, ignore_checkpoints=False,
+                              today=None):
+    """Walks one partition's cursor to the end, checkpointing after each page is saved.
+
+    insert_pub_fn has to raise if a page isn't saved, otherwise the checkpoint moves past it.
+
+    A partition marked done is only skipped if its range ended before today, because crossref
+    can still add records to a range that hasn't closed yet. Returns the number of pubs added.
+    """
+    key = partition_key(partition, get_updates)
+    checkpoint = None if ignore_checkpoints else checkpoints.load(key)
+    today = today or datetime.date.today()
+
+    if checkpoint and checkpoint[1]:
+        if partition.last < today:
+            logger.info('{} was already ingested, skipping'.format(key))
+            return 0
+
+        logger.info('{} was ingested but is still open, walking it again'.format(key))
+        checkpoint = None
+
+    next_cursor = (checkpoint and checkpoint[0]) or '*'
+    num_pubs_added = 0
+
+    while True:
+        url = crossref_partition_url(partition, next_cursor, chunk_size, get_updates, api_url=api_url)
+        logger.info('{}: calling url: {}'.format(key, url))
+        crossref_time = time()
+        resp = get_response_page(url)
+
+        if resp.status_code != 200:
+            if next_cursor != '*':
+                # crossref cursors expire after a few minutes idle, so a saved one may be gone
+                logger.info('{}: error {} resuming from saved cursor, starting the partition over'.format(key, resp.status_code))
+                next_cursor = '*'
+                continue
+
+            raise RequestException('{}: error in crossref call, status_code = {}'.format(key, resp.status_code))
+
+        crossref_answer_time = time()
+        logger.info('{}: getting crossref response took {} seconds'.format(key, elapsed(crossref_time, 2)))
+
+        resp_data = resp.json()['message']
+        pubs_this_page = []
+        for api_raw in resp_data['items']:
+            my_pub = build_new_pub(normalize_doi(api_raw['DOI']), api_raw)
+
+            # hack so it gets updated soon
+            my_pub.updated = datetime.datetime(1042, 1, 1)
+
+            pubs_this_page.append(my_pub)
+
+        for pubs_chunk in chunks(pubs_this_page, 100):
+            num_pubs_added += len(insert_pub_fn(pubs_chunk))
+
+        next_cursor = resp_data.get('next-cursor', None)
+        done = not resp_data['items'] or not next_cursor
+        checkpoints.save(key, next_cursor, done)
+
+        if done:
+            break
+
+        # be nice
+        sleep(max(0, seconds_between_requests - elapsed(crossref_answer_time)))
+
+    logger.info('{}: added {} new crossref dois'.format(key, num_pubs_added))
+    return num_pubs_added
+
+
+def ingest_crossref_partitions(partitions, concurrency, insert_pub_fn, checkpoints, **partition_kwargs):
+    """Ingests the partitions, up to concurrency of them at a time. Returns the number of pubs added."""
+    start_time = time()
+    num_pubs_added = 0
+    failed_partitions = []
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = dict(
+            (executor.submit(ingest_crossref_partition, partition, insert_pub_fn, checkpoints, **partition_kwargs), partition)
+            for partition in partitions
+        )
+
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                num_pubs_added += future.result()
+            except Exception as e:
+                logger.exception('partition {} failed: {}'.format(futures[future], e))
+                failed_partitions.append(futures[future])
+
+    logger.info('Added >>{}<< new crossref dois from {} partitions, took {} seconds'.format(
+        num_pubs_added, len(partitions), elapsed(start_time, 2)))
+
+    if failed_partitions:
+        logger.info('{} partitions failed and will resume from their checkpoints next run: {}'.format(
+            len(failed_partitions), failed_partitions))
+
+    return num_pubs_added
+
+
 # this one is used for catch up.  use the above function when we want all weekly dois
 def scroll_through_all_dois(query_doi=None, first=None, last=None, today=False, week=False, now=False, chunk_size=1000):
     # needs a mailto, see https://github.com/CrossRef/rest-api-doc#good-manners--more-reliable-service
@@ -323,6 +507,10 @@ if __name__ == "__main__":
 
     parser.add_argument('--get-updates', action="store_true", default=False, help="use if you want to get updates within the date range, not just new records")
 
+    parser.add_argument('--partitions', nargs="?", type=int, help="split the date range into this many partitions, each with its own cursor")
+    parser.add_argument('--concurrency', nargs="?", type=int, default=4, help="how many partitions to ingest at once")
+    parser.add_argument('--ignore-checkpoints', '--restart', action="store_true", default=False, help="walk every partition from the start, ignoring saved checkpoints")
+
     parsed = parser.parse_args()
 
     logger.info("calling {} with these args: {}".format(function.__name__, vars(parsed)))
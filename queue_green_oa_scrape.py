@@ -1,5 +1,4 @@
 import argparse
-import concurrent.futures
 import logging
 import os
 import pickle
@@ -17,10 +16,13 @@ from sqlalchemy.orm import make_transient
 
 from app import db
 from app import logger
+from host_scheduler import HostScheduler
+from host_scheduler import ScrapeJob
 from oa_page import publisher_equivalent_endpoint_id
 from page import PageNew
 from queue_main import DbQueue
 from recordthresher.record_maker import PmhRecordMaker
+from util import TimeoutProcessPool
 from util import elapsed
 from util import safe_commit
 
@@ -33,6 +35,26 @@ def _procs_per_worker():
     return int(os.getenv('GREEN_SCRAPE_PROCS_PER_WORKER', 10))
 
 
+def _scrape_timeout_seconds():
+    return 300
+
+
+def _default_scrape_interval_seconds():
+    return 10
+
+
+def _max_rate_limit_wait_seconds():
+    return 60
+
+
+class GreenScrapeHostInterval(db.Model):
+    """Seconds between scrapes of a host, for hostnames ending with `hostname`."""
+    __tablename__ = 'green_scrape_host_interval'
+
+    hostname = db.Column(db.Text, primary_key=True)
+    interval_seconds = db.Column(db.Numeric, nullable=False)
+
+
 def _redis_max_connections():
     return 2
 
@@ -55,7 +77,22 @@ def get_redis_client():
     return _redis_client
 
 
+_scrape_pool = None
+
+
+def get_scrape_pool():
+    # kept for the life of the process, workers are only replaced when they time out
+    global _scrape_pool
+
+    if _scrape_pool is None:
+        _scrape_pool = TimeoutProcessPool(scrape_page, _procs_per_worker(), _scrape_timeout_seconds())
+
+    return _scrape_pool
+
+
 def scrape_pages(pages):
+    host_intervals = get_host_intervals()
+
     for page in pages:
         make_transient(page)
 
@@ -63,9 +100,16 @@ def scrape_pages(pages):
     db.session.close()
     db.engine.dispose()
 
-    with concurrent.futures.ProcessPoolExecutor(max_workers=_procs_per_worker()) as pool:
-        map_results = pool.map(scrape_page, pages, chunksize=1)
-        scraped_pages = [p for p in map_results if p]
+    scheduler = HostScheduler(get_redis_client(), max_wait_seconds=_max_rate_limit_wait_seconds())
+    scheduled_jobs, deferred_pages = scheduler.schedule([
+        ScrapeJob(page, redis_key(page, ''), scrape_interval_seconds(page, host_intervals)) for page in pages
+    ])
+
+    if deferred_pages:
+        logger.info('deferring {} pages until their hosts are ready'.format(len(deferred_pages)))
+
+    map_results = get_scrape_pool().map(scheduled_jobs)
+    scraped_pages = [p for p in map_results if p]
 
     logger.info('finished scraping all pages')
 
@@ -85,34 +129,34 @@ def scrape_pages(pages):
     return scraped_pages
 
 
-def scrape_page(page):
-    with concurrent.futures.ProcessPoolExecutor(max_workers=1) as pool:
-        worker = current_process().name
-        try:
-            return pool.submit(scrape_page_worker, page).result(timeout=300)
-        except concurrent.futures.TimeoutError as e:
-            logger.error(f'{worker} timed out')
-            for pid, process in pool._processes.items():
-                process.terminate()
-            pool.shutdown()
-            return None
-        except (KeyboardInterrupt, SystemExit):
-            pass
-        except Exception as e:
-            logger.exception(f'{worker} exception scraping page {page.id}')
-            return None
+def scrape_page(scheduled_job):
+    # runs in a scrape pool worker, which is killed and replaced if this takes too long
+    worker = current_process().name
+    page = scheduled_job.item
+    try:
+        wait_seconds = (scheduled_job.not_before - datetime.utcnow()).total_seconds()
+        if wait_seconds > 0:
+            sleep(wait_seconds)
+
+        return scrape_page_worker(page, scheduled_job.interval_seconds)
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    except Exception as e:
+        logger.exception(f'{worker} exception scraping page {page.id}')
+        return None
 
 
-def scrape_page_worker(page):
+def scrape_page_worker(page, interval_seconds=None):
     worker = current_process().name
     site_key_stem = redis_key(page, '')
 
     logger.info('{} started scraping page {} {} {}'.format(worker, page.id, site_key_stem, page))
 
+    # pages are scheduled for when their host is ready, so this only waits for other workers' scrapes
     total_wait_seconds = 0
     wait_seconds = 5
-    while total_wait_seconds < 60:
-        if begin_rate_limit(page):
+    while total_wait_seconds < _max_rate_limit_wait_seconds():
+        if begin_rate_limit(page, interval_seconds):
             page.scrape()
             end_rate_limit(page)
             logger.info('{} finished scraping page {} {} {}'.format(worker, page.id, site_key_stem, page))
@@ -136,32 +180,33 @@ def redis_key(page, scrape_property):
     return 'green-scrape-p3:{}:{}:{}'.format(page.endpoint_id, domain, scrape_property)
 
 
-def scrape_interval_seconds(page):
-    hostname = urlparse(page.url).hostname
+def get_host_intervals():
+    try:
+        return {
+            row.hostname: float(row.interval_seconds)
+            for row in GreenScrapeHostInterval.query.all()
+        }
+    except Exception as e:
+        logger.exception(f'failed loading green scrape host intervals, using defaults: {e}')
+        db.session.rollback()
+        return {}
 
-    one_sec_hosts = [
-        'citeseerx.ist.psu.edu',
-        'www.ncbi.nlm.nih.gov',
-        'pt.cision.com',
-        'doaj.org',
-        'hal.archives-ouvertes.fr',
-        'figshare.com',
-        'arxiv.org',
-        'europepmc.org',
-        'bibliotheques-specialisees.paris.fr',
-        'nbn-resolving.de',
-        'osti.gov',
-        'zenodo.org',
-        'kuleuven.be',
-        'edoc.hu-berlin.de',
-        'rug.nl',
-    ]
 
-    for host in one_sec_hosts:
-        if hostname and hostname.endswith(host):
-            return 1
+def scrape_interval_seconds(page, host_intervals=None):
+    if page.endpoint_id == publisher_equivalent_endpoint_id:
+        return 0
 
-    return 10
+    if host_intervals is None:
+        host_intervals = get_host_intervals()
+
+    hostname = urlparse(page.url).hostname
+
+    # the most specific matching hostname wins
+    matching_hosts = [host for host in host_intervals if hostname and hostname.endswith(host)]
+    if matching_hosts:
+        return host_intervals[max(matching_hosts, key=len)]
+
+    return _default_scrape_interval_seconds()
 
 
 def begin_rate_limit(page, interval_seconds=None):
@@ -170,7 +215,8 @@ def begin_rate_limit(page, interval_seconds=None):
     if page.endpoint_id == publisher_equivalent_endpoint_id:
         return True
 
-    interval_seconds = interval_seconds or scrape_interval_seconds(page)
+    if interval_seconds is None:
+        interval_seconds = scrape_interval_seconds(page)
 
     started_key = redis_key(page, 'started')
     finished_key = redis_key(page, 'finished')
@@ -1,3 +1,4 @@
+import concurrent.futures
 import datetime
 import os
 from subprocess import call
@@ -8,6 +9,7 @@ import heroku3
 
 from app import HEROKU_APP_NAME
 from app import db
+from app import db_pool_mode
 from app import logger
 from util import elapsed
 from util import get_sql_answer
@@ -141,12 +143,13 @@ class DbQueue(object):
 
 
 
-    def update_fn(self, cls, method_name, objects, index=1):
+    def update_fn(self, cls, method_name, objects, index=1, concurrency=1):
 
         # we are in a fork!  dispose of our engine.
         # will get a new one automatically
-        # if is pooling, need to do .dispose() instead
-        db.engine.dispose()
+        # a pooled engine checks for forks itself, and disposing would throw the pool away every chunk
+        if db_pool_mode() != "queue":
+            db.engine.dispose()
 
         start = time()
         num_obj_rows = len(objects)
@@ -159,12 +162,18 @@ class DbQueue(object):
         #     elapsed=elapsed(start)
         # ))
 
+        prefetches = self.start_prefetches(method_name, objects, concurrency)
+
         for count, obj in enumerate(objects):
             start_time = time()
 
             if obj is None:
                 return None
 
+            if prefetches:
+                # raises here, in order, if the prefetch failed
+                prefetches[count].result()
+
             method_to_run = getattr(obj, method_name)
 
             # logger.info(u"***")
@@ -194,8 +203,34 @@ class DbQueue(object):
             logger.info("COMMIT fail")
         logger.info("commit took {} seconds".format(elapsed(start_time, 2)))
         db.session.remove()  # close connection nicely
+
+        chunk_seconds = elapsed(start, 2)
+        logger.info("{method_name}() on {num_obj_rows} objects with concurrency {concurrency} took {chunk_seconds} seconds, {rate} objects/second".format(
+            method_name=method_name,
+            num_obj_rows=num_obj_rows,
+            concurrency=concurrency,
+            chunk_seconds=chunk_seconds,
+            rate=round(num_obj_rows / chunk_seconds, 2) if chunk_seconds else num_obj_rows
+        ))
         return None  # important for if we use this on RQ
 
+    def start_prefetches(self, method_name, objects, concurrency):
+        # if the objects can split out the network part of method_name as prefetch_<method_name>,
+        # run that for up to `concurrency` objects at once while update_fn works through them in order.
+        # the prefetches must not touch db.session, so only the main thread writes to it.
+        prefetch_name = "prefetch_{}".format(method_name)
+        if concurrency <= 1 or not objects or not all(hasattr(obj, prefetch_name) for obj in objects):
+            return None
+
+        # end the session before the scrapes, like a serial refresh does.
+        # the objects are merged back in as update_fn reaches them.
+        db.session.close()
+
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=concurrency)
+        prefetches = [executor.submit(getattr(obj, prefetch_name)) for obj in objects]
+        executor.shutdown(wait=False)
+        return prefetches
+
     def run(self, parsed_args, job_type):
         start = time()
 
@@ -12,6 +12,8 @@ from app import db
 from app import logger
 from endpoint import Endpoint  # magic
 from pub import Pub
+from pub import deferred_issn_l_lookups
+from pub import set_issn_ls
 from queue_main import DbQueue
 from util import elapsed
 from util import normalize_doi
@@ -34,6 +36,7 @@ class DbQueuePub(DbQueue):
         limit = kwargs.get("limit", 10)
         run_class = Pub
         run_method = kwargs.get("method")
+        concurrency = kwargs.get("concurrency") or 1
 
         if single_obj_id:
             limit = 1
@@ -104,7 +107,9 @@ class DbQueuePub(DbQueue):
 
                 job_time = time()
                 q = db.session.query(Pub).options(orm.undefer('*')).filter(Pub.id.in_(object_ids))
-                objects = q.all()
+                with deferred_issn_l_lookups():
+                    objects = q.all()
+                set_issn_ls(objects)
                 logger.info("got pub objects in {} seconds".format(elapsed(job_time)))
 
                 # shuffle them or they sort by doi order
@@ -127,7 +132,7 @@ class DbQueuePub(DbQueue):
                 continue
 
             object_ids = [obj.id for obj in objects]
-            self.update_fn(run_class, run_method, objects, index=index)
+            self.update_fn(run_class, run_method, objects, index=index, concurrency=concurrency)
 
             # logger.info(u"finished update_fn")
             if queue_table:
@@ -166,6 +171,7 @@ if __name__ == "__main__":
     parser.add_argument('--kick', default=False, action='store_true', help="put started but unfinished dois back to unstarted so they are retried")
     parser.add_argument('--limit', "-l", nargs="?", type=int, help="how many jobs to do")
     parser.add_argument('--chunk', "-ch", nargs="?", default=500, type=int, help="how many to take off db at once")
+    parser.add_argument('--concurrency', nargs="?", default=int(os.getenv('PUB_REFRESH_CONCURRENCY', 1)), type=int, help="how many objects to fetch at once in each chunk")
 
     parsed_args = parser.parse_args()
 
@@ -0,0 +1,44 @@
+from time import time
+
+
+# fixed allowance per key, refilled when the key expires.
+# KEYS[1] = bucket key, ARGV[1] = allowance, ARGV[2] = period in seconds
+# returns 1 if the request is over the limit
+_REQUEST_BUCKET_SCRIPT = """
+local remaining = redis.call('GET', KEYS[1])
+if not remaining then
+    redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+    remaining = ARGV[1]
+end
+if tonumber(remaining) > 0 then
+    redis.call('DECR', KEYS[1])
+    return 0
+end
+return 1
+"""
+
+# distinct members seen in a sliding window.
+# KEYS[1] = sorted set key, ARGV[1] = member, ARGV[2] = now, ARGV[3] = window in seconds
+# returns the number of distinct members in the window, including this one
+_SLIDING_WINDOW_SCRIPT = """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], 0, tonumber(ARGV[2]) - tonumber(ARGV[3]))
+redis.call('ZADD', KEYS[1], ARGV[2], ARGV[1])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+return redis.call('ZCARD', KEYS[1])
+"""
+
+
+class RateLimiter(object):
+    """API rate limits, each checked and updated in one atomic script call."""
+
+    def __init__(self, redis_client, clock=time):
+        self.clock = clock
+        self.request_bucket = redis_client.register_script(_REQUEST_BUCKET_SCRIPT)
+        self.sliding_window = redis_client.register_script(_SLIDING_WINDOW_SCRIPT)
+
+    def too_many_requests(self, key, limit, period_seconds):
+        return self.request_bucket(keys=[key], args=[limit, int(period_seconds)]) == 1
+
+    def too_many_members(self, key, member, max_members, window_seconds):
+        members = self.sliding_window(keys=[key], args=[member, self.clock(), int(window_seconds)])
+        return members > max_members
@@ -0,0 +1,135 @@
+import os
+import threading
+from time import monotonic
+
+import redis
+from cachetools import TTLCache
+
+from app import logger
+
+# variants of the /v2/<doi> response that are cached separately
+DEFAULT_VARIANT = 'default'
+SKIP_ALL_HYBRID_VARIANT = 'skip_all_hybrid'
+VARIANTS = [DEFAULT_VARIANT, SKIP_ALL_HYBRID_VARIANT]
+
+
+class LruResponseStore(object):
+    """Keeps responses in this process. Only this process can invalidate them."""
+
+    def __init__(self, maxsize, ttl_seconds, clock=monotonic):
+        self.cache = TTLCache(maxsize=maxsize, ttl=ttl_seconds, timer=clock)
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            return self.cache.get(key)
+
+    def set(self, key, value):
+        with self.lock:
+            self.cache[key] = value
+
+    def delete(self, keys):
+        with self.lock:
+            for key in keys:
+                self.cache.pop(key, None)
+
+
+class RedisResponseStore(object):
+    """Keeps responses in redis, so every web dyno shares them and workers can invalidate them."""
+
+    def __init__(self, redis_client, ttl_seconds):
+        self.redis_client = redis_client
+        self.ttl_seconds = ttl_seconds
+
+    def get(self, key):
+        value = self.redis_client.get(key)
+        return value.decode('utf-8') if value is not None else None
+
+    def set(self, key, value):
+        self.redis_client.set(key, value, ex=self.ttl_seconds)
+
+    def delete(self, keys):
+        self.redis_client.delete(*keys)
+
+
+class ResponseCache(object):
+    """Serialized /v2/<doi> responses keyed by normalized DOI and response variant."""
+
+    def __init__(self, store):
+        self.store = store
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(doi, variant):
+        return 'v2-response:{}:{}'.format(doi, variant)
+
+    def get(self, doi, variant):
+        try:
+            value = self.store.get(self.key(doi, variant))
+        except Exception as e:
+            logger.exception('failed reading response cache: {}'.format(e))
+            value = None
+
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+
+        if (self.hits + self.misses) % 1000 == 0:
+            logger.info('v2 response cache stats: {}'.format(self.stats()))
+
+        return value
+
+    def set(self, doi, variant, value):
+        try:
+            self.store.set(self.key(doi, variant), value)
+        except Exception as e:
+            logger.exception('failed writing response cache: {}'.format(e))
+
+    def invalidate(self, doi):
+        try:
+            self.store.delete([self.key(doi, variant) for variant in VARIANTS])
+        except Exception as e:
+            logger.exception('failed invalidating response cache: {}'.format(e))
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else None,
+        }
+
+
+_response_cache = None
+_response_cache_init = False
+
+
+def get_response_cache():
+    # V2_RESPONSE_CACHE is "lru", "redis", or unset for no caching
+    global _response_cache, _response_cache_init
+
+    if not _response_cache_init:
+        cache_type = os.getenv('V2_RESPONSE_CACHE')
+        ttl_seconds = int(os.getenv('V2_RESPONSE_CACHE_TTL_SECONDS', 300))
+
+        try:
+            if cache_type == 'lru':
+                max_size = int(os.getenv('V2_RESPONSE_CACHE_MAX_SIZE', 10000))
+                _response_cache = ResponseCache(LruResponseStore(max_size, ttl_seconds))
+            elif cache_type == 'redis':
+                redis_client = redis.from_url(os.environ.get('REDIS_URL'))
+                _response_cache = ResponseCache(RedisResponseStore(redis_client, ttl_seconds))
+        except Exception as e:
+            logger.exception('failed creating response cache: {}'.format(e))
+
+        _response_cache_init = True
+
+    return _response_cache
+
+
+def invalidate_cached_response(doi):
+    response_cache = get_response_cache()
+    if response_cache:
+        response_cache.invalidate(doi)
@@ -3,7 +3,7 @@
 
 for (( i=1; i<=$PUB_REFRESH_WORKERS_PER_DYNO; i++ ))
 do
-  COMMAND="python queue_pub.py --run --method=refresh --chunk=$PUB_REFRESH_CHUNK_SIZE"
+  COMMAND="python queue_pub.py --run --method=refresh --chunk=$PUB_REFRESH_CHUNK_SIZE --concurrency=${PUB_REFRESH_CONCURRENCY:-1}"
   echo $COMMAND
   $COMMAND&
 done
@@ -1,3 +1,4 @@
+import os
 from gzip import decompress
 from urllib.parse import quote
 
@@ -26,7 +27,62 @@ def _get_obj(bucket, key, f, s3=None, _raise=False):
 
 
 def check_exists(bucket, key, s3=None, _raise=False):
-    return _get_obj(bucket, key, lambda obj: bool(obj), s3=s3, _raise=_raise)
+    # head_object, so we don't start downloading the object just to see if it's there
+    if not s3:
+        s3 = _s3
+    try:
+        s3.head_object(Bucket=bucket, Key=key)
+        return True
+    except botocore.exceptions.ClientError as e:
+        if not _raise:
+            return False
+        raise e
+
+
+def existing_keys(bucket, keys, s3=None, max_keys=50):
+    """Return the set of keys that exist in bucket, using listings instead of a request per key.
+
+    Walks the sorted keys and lists up to max_keys objects from just before the first one not
+    answered yet. One listing answers every key up to the last key it returns, so it pays off when
+    the keys are close together. Once a listing answers no more than one key the batch is sparse,
+    and a listing would cost more than a HEAD, so the rest are checked with check_exists.
+    """
+    if not s3:
+        s3 = _s3
+
+    sorted_keys = sorted(set(keys))
+    found = set()
+    i = 0
+    start_after = sorted_keys[0][:-1] if sorted_keys else None
+
+    while i < len(sorted_keys):
+        response = s3.list_objects_v2(
+            Bucket=bucket,
+            Prefix=os.path.commonprefix([sorted_keys[i], sorted_keys[-1]]),
+            StartAfter=start_after,
+            MaxKeys=max_keys,
+        )
+        listed_keys = [obj['Key'] for obj in response.get('Contents', [])]
+        found.update(listed_keys)
+
+        if not response.get('IsTruncated') or not listed_keys:
+            # nothing else in the range
+            break
+
+        last_listed_key = listed_keys[-1]
+        first_unanswered = i
+        while i < len(sorted_keys) and sorted_keys[i] <= last_listed_key:
+            i += 1
+
+        if i - first_unanswered <= 1:
+            found.update(key for key in sorted_keys[i:] if check_exists(bucket, key, s3=s3))
+            break
+
+        if i < len(sorted_keys):
+            # skip the gap up to the next key, but always move past what we've listed
+            start_after = max(last_listed_key, sorted_keys[i][:-1])
+
+    return found.intersection(sorted_keys)
 
 
 def get_object(bucket, key, s3=None, _raise=False):
@@ -3,6 +3,45 @@ from sqlalchemy import sql
 from app import db
 from pub import Pub
 
+# title_tsv and its GIN index come from sql/title_search.sql
+FULLTEXT_SEARCH_SQL = '''
+    with matches as materialized (
+        select id, title, title_tsv, query, response_is_oa
+        from pub, websearch_to_tsquery('english', :search_str) query
+        where title_tsv @@ query
+        limit 1000
+    )
+    select
+        id,
+        ts_headline('english', title, query),
+        ts_rank_cd(title_tsv, query, 1) as rank
+    from matches
+    where {oa_clause}
+    order by rank desc limit 50 offset {offset}
+    ;'''
+
+# the ilike filter uses the trigram index pub_2018_title_trgm_idx from sql/title_search.sql
+AUTOCOMPLETE_SQL = r'''
+    with s as (SELECT id, lower(title) as lower_title FROM pub_2018 WHERE title iLIKE :p0)
+    select match, count(*) as score from (
+        SELECT regexp_matches(lower_title, :p1, 'g') as match FROM s
+        union all
+        SELECT regexp_matches(lower_title, :p2, 'g') as match FROM s
+        union all
+        SELECT regexp_matches(lower_title, :p3, 'g') as match FROM s
+        union all
+        SELECT regexp_matches(lower_title, :p4, 'g') as match FROM s
+    ) s_all
+    group by match
+    order by score desc, length(match::text) asc
+    LIMIT 50;'''
+
+
+def like_pattern_contains(text):
+    # match text literally anywhere, not as a pattern
+    escaped = text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return '%{}%'.format(escaped)
+
 
 def fulltext_search_title(query, is_oa=None, page=1):
     if query:
@@ -10,21 +49,7 @@ def fulltext_search_title(query, is_oa=None, page=1):
 
     oa_clause = 'true' if is_oa is None else 'response_is_oa' if is_oa else 'not response_is_oa'
 
-    query_statement = sql.text('''
-        with matches as materialized (
-            select id, title, query, response_is_oa
-            from pub, websearch_to_tsquery('english', :search_str) query
-            where to_tsvector('english', title) @@ query
-            limit 1000
-        )
-        select
-            id,
-            ts_headline('english', title, query),
-            ts_rank_cd(to_tsvector('english', title), query, 1) as rank
-        from matches
-        where {oa_clause}
-        order by rank desc limit 50 offset {offset}
-        ;'''.format(oa_clause=oa_clause, offset=int(page-1)*50))
+    query_statement = sql.text(FULLTEXT_SEARCH_SQL.format(oa_clause=oa_clause, offset=int(page-1)*50))
 
     rows = db.engine.execute(query_statement.bindparams(search_str=query)).fetchall()
     search_results = {row[0]: {'snippet': row[1], 'score': row[2]} for row in rows}
@@ -50,21 +75,8 @@ def fulltext_search_title(query, is_oa=None, page=1):
     return sorted(filtered_responses, key=lambda r: r['score'], reverse=True)
 
 def autocomplete_phrases(query):
-    query_statement = sql.text(r"""
-        with s as (SELECT id, lower(title) as lower_title FROM pub_2018 WHERE title iLIKE :p0)
-        select match, count(*) as score from (
-            SELECT regexp_matches(lower_title, :p1, 'g') as match FROM s
-            union all
-            SELECT regexp_matches(lower_title, :p2, 'g') as match FROM s
-            union all
-            SELECT regexp_matches(lower_title, :p3, 'g') as match FROM s
-            union all
-            SELECT regexp_matches(lower_title, :p4, 'g') as match FROM s
-        ) s_all
-        group by match
-        order by score desc, length(match::text) asc
-        LIMIT 50;""").bindparams(
-            p0='%{}%'.format(query),
+    query_statement = sql.text(AUTOCOMPLETE_SQL).bindparams(
+            p0=like_pattern_contains(query),
             p1=r'({}\w*?\M)'.format(query),
             p2=r'({}\w*?(?:\s+\w+){{1}})\M'.format(query),
             p3=r'({}\w*?(?:\s+\w+){{2}})\M'.format(query),
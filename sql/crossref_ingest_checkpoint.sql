@@ -0,0 +1,9 @@
+-- how far each partition of a partitioned put_crossref_in_db.py run got.
+-- partition_key is like index:2021-01-01:2021-01-07
+
+create table crossref_ingest_checkpoint (
+    partition_key text primary key,
+    next_cursor text,
+    done boolean not null default false,
+    updated timestamp without time zone
+);
@@ -0,0 +1,24 @@
+-- seconds between green oa scrapes of a host, for hostnames ending with `hostname`.
+-- hosts not listed here are scraped at most every 10 seconds.
+
+create table green_scrape_host_interval (
+    hostname text primary key,
+    interval_seconds numeric not null
+);
+
+insert into green_scrape_host_interval (hostname, interval_seconds) values
+    ('citeseerx.ist.psu.edu', 1),
+    ('www.ncbi.nlm.nih.gov', 1),
+    ('pt.cision.com', 1),
+    ('doaj.org', 1),
+    ('hal.archives-ouvertes.fr', 1),
+    ('figshare.com', 1),
+    ('arxiv.org', 1),
+    ('europepmc.org', 1),
+    ('bibliotheques-specialisees.paris.fr', 1),
+    ('nbn-resolving.de', 1),
+    ('osti.gov', 1),
+    ('zenodo.org', 1),
+    ('kuleuven.be', 1),
+    ('edoc.hu-berlin.de', 1),
+    ('rug.nl', 1);
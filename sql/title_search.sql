@@ -0,0 +1,14 @@
+-- indexes for title search and autocomplete in search.py.
+-- run outside a transaction block, because of the concurrent index builds.
+-- needs postgres 12+ for the generated column.
+
+-- adding a stored generated column rewrites pub, so run this in a maintenance window.
+alter table pub add column if not exists title_tsv tsvector
+    generated always as (to_tsvector('english', coalesce(title, ''))) stored;
+
+create index concurrently if not exists pub_title_tsv_idx on pub using gin (title_tsv);
+
+-- lets the title ilike '%...%' autocomplete filter use an index
+create extension if not exists pg_trgm;
+
+create index concurrently if not exists pub_2018_title_trgm_idx on pub_2018 using gin (title gin_trgm_ops);
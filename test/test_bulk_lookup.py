@@ -0,0 +1,161 @@
+import csv
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import mock
+from nose.tools import assert_equals
+from openpyxl import load_workbook
+
+import bulk_lookup
+import views
+from bulk_lookup import BulkLookupFiles
+from bulk_lookup import lookup_v2_responses
+from bulk_lookup import write_bulk_lookup_files
+
+
+def fake_db(responses):
+    # a db whose session answers the "id = any(:ids)" query from responses, keyed by pub id
+    def execute(query, params):
+        rows = [(responses[pub_id],) for pub_id in params['ids'] if pub_id in responses]
+        return mock.Mock(fetchall=mock.Mock(return_value=rows))
+
+    return mock.Mock(session=mock.Mock(execute=mock.Mock(side_effect=execute)))
+
+
+def new_pub_response(doi, crossref_api):
+    return mock.Mock(to_dict_v2=mock.Mock(return_value={'doi': doi, 'built': True}))
+
+
+class TestLookupV2Responses(unittest.TestCase):
+    def lookup(self, responses, dirty_dois):
+        with mock.patch.object(bulk_lookup, 'db', fake_db(responses)), \
+                mock.patch.object(bulk_lookup, 'build_new_pub', side_effect=new_pub_response) as build_new_pub:
+            return lookup_v2_responses(dirty_dois), build_new_pub
+
+    def test_normalized_doi_first(self):
+        responses, build_new_pub = self.lookup(
+            {'10.1/a.': {'doi': '10.1/a.'}, '10.1/a': {'doi': '10.1/a'}},
+            ['https://doi.org/10.1/A.']
+        )
+        assert_equals(responses, [{'doi': '10.1/a.'}])
+        assert_equals(build_new_pub.call_count, 0)
+
+    def test_then_cleaned_doi(self):
+        responses, build_new_pub = self.lookup({'10.1/a': {'doi': '10.1/a'}}, ['10.1/A.'])
+        assert_equals(responses, [{'doi': '10.1/a'}])
+        assert_equals(build_new_pub.call_count, 0)
+
+    def test_then_new_pub(self):
+        responses, build_new_pub = self.lookup({'10.1/a': {'doi': '10.1/a'}}, ['10.1/a', '10.1/B', 'not a doi'])
+        assert_equals(responses, [
+            {'doi': '10.1/a'},
+            {'doi': '10.1/B', 'built': True},
+            {'doi': 'not a doi', 'built': True},
+        ])
+
+
+class TestBulkLookupFiles(unittest.TestCase):
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.output_dir)
+
+    def write(self, responses, formats):
+        output_files = BulkLookupFiles(self.output_dir, formats)
+        for response in responses:
+            output_files.write(response)
+        return output_files.close()
+
+    def test_writes_every_format(self):
+        responses = [
+            {'doi': '10.1/a', 'is_oa': True, 'best_oa_location': {'url': 'https://example.com/a.pdf'}},
+            {'doi': '10.1/b', 'is_oa': False},
+        ]
+        files = self.write(responses, ['jsonl', 'csv', 'xlsx'])
+        assert_equals([os.path.basename(f) for f in files], ['output.jsonl', 'output.csv', 'output.xlsx'])
+
+        with open(files[0]) as f:
+            assert_equals([json.loads(line) for line in f], responses)
+
+        with open(files[1]) as f:
+            rows = list(csv.DictReader(f))
+        assert_equals([row['doi'] for row in rows], ['10.1/a', '10.1/b'])
+        assert_equals(rows[0]['best_oa_url'], 'https://example.com/a.pdf')
+
+        sheet_rows = list(load_workbook(files[2]).active.values)
+        assert_equals(list(sheet_rows[0]), list(rows[0].keys()))
+        assert_equals([row[0] for row in sheet_rows[1:]], ['10.1/a', '10.1/b'])
+
+    def test_only_requested_formats(self):
+        files = self.write([{'doi': '10.1/a'}], ['csv'])
+        assert_equals([os.path.basename(f) for f in files], ['output.csv'])
+
+    def test_no_csv_rows(self):
+        # empty responses go in the jsonl file but have no csv row, so the csv file is never started
+        files = self.write([{}, {}], ['jsonl', 'csv', 'xlsx'])
+        assert_equals([os.path.basename(f) for f in files], ['output.jsonl', 'output.xlsx'])
+
+        with open(files[0]) as f:
+            assert_equals(f.read(), '{}\n{}\n')
+        assert_equals(list(load_workbook(files[1]).active.values), [])
+
+
+class TestWriteBulkLookupFiles(unittest.TestCase):
+    def test_progress_after_each_chunk(self):
+        dois = ['10.1/{}'.format(i) for i in range(5)]
+        output_files = mock.Mock()
+
+        with mock.patch.object(bulk_lookup, 'db'), \
+                mock.patch.object(bulk_lookup, 'lookup_v2_responses', side_effect=lambda chunk: [{'doi': d} for d in chunk]):
+            progress = list(write_bulk_lookup_files(dois, output_files, chunk_size=2))
+
+        assert_equals(progress, [
+            (2, 5, ['10.1/0', '10.1/1']),
+            (4, 5, ['10.1/2', '10.1/3']),
+            (5, 5, ['10.1/4']),
+        ])
+        assert_equals([c[0][0]['doi'] for c in output_files.write.call_args_list], dois)
+
+
+class TestSimpleQueryTool(unittest.TestCase):
+    def test_concurrent_requests_get_their_own_directories(self):
+        output_dirs = []
+        both_writing = threading.Barrier(2, timeout=10)
+
+        class RecordingFiles(BulkLookupFiles):
+            def __init__(self, output_dir, formats):
+                output_dirs.append(output_dir)
+                both_writing.wait()
+                super(RecordingFiles, self).__init__(output_dir, formats)
+
+        def lookup(chunk):
+            return [{'doi': d} for d in chunk]
+
+        results = []
+
+        def post(email):
+            response = views.app.test_client().post('/v2/dois', json={'dois': ['10.1/a', '10.1/b'], 'email': email})
+            results.append((email, response.status_code, response.get_json()))
+
+        with mock.patch.object(views, 'BulkLookupFiles', RecordingFiles), \
+                mock.patch.object(bulk_lookup, 'lookup_v2_responses', side_effect=lookup), \
+                mock.patch.object(bulk_lookup, 'db'), \
+                mock.patch.object(views, 'create_email') as create_email, \
+                mock.patch.object(views, 'send'):
+            threads = [threading.Thread(target=post, args=(email,)) for email in ['a@example.com', 'b@example.com']]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        assert_equals(sorted(status for email, status, body in results), [200, 200])
+        assert_equals(len(set(output_dirs)), 2)
+        assert_equals([os.path.exists(d) for d in output_dirs], [False, False])
+
+        emailed_files = [c[0][4] for c in create_email.call_args_list]
+        for files in emailed_files:
+            assert_equals(len(set(os.path.dirname(f) for f in files)), 1)
+        assert_equals(len(set(os.path.dirname(files[0]) for files in emailed_files)), 2)
@@ -0,0 +1,212 @@
+import datetime
+import json
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from nose.tools import assert_equals
+
+from put_crossref_in_db import CrossrefPartition
+from put_crossref_in_db import date_partitions
+from put_crossref_in_db import ingest_crossref_partitions
+from put_crossref_in_db import partition_key
+
+
+class MemoryCheckpoints(object):
+    def __init__(self, checkpoints=None):
+        self.checkpoints = checkpoints or {}
+        self.lock = threading.Lock()
+
+    def load(self, key):
+        return self.checkpoints.get(key)
+
+    def save(self, key, next_cursor, done):
+        with self.lock:
+            self.checkpoints[key] = (next_cursor, done)
+
+
+class CannedCrossref(BaseHTTPRequestHandler):
+    # {filter: {cursor: (dois, next cursor)}}
+    pages = {}
+    requests = []
+
+    def do_GET(self):
+        params = parse_qs(urlparse(self.path).query)
+        filter_param, cursor = params['filter'][0], params['cursor'][0]
+        CannedCrossref.requests.append((filter_param, cursor))
+
+        page = self.pages.get(filter_param, {}).get(cursor)
+        if not page:
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        dois, next_cursor = page
+        body = json.dumps({'message': {'items': [{'DOI': doi} for doi in dois], 'next-cursor': next_cursor}})
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(body.encode('utf-8'))
+
+    def log_message(self, *args):
+        pass
+
+
+def canned_filter(first, last):
+    return 'from-created-date:{},until-created-date:{}'.format(first, last)
+
+
+class TestDatePartitions(unittest.TestCase):
+    def test_splits_days_evenly(self):
+        partitions = date_partitions(datetime.date(2021, 1, 1), datetime.date(2021, 1, 10), 3)
+        assert_equals(partitions, [
+            CrossrefPartition(datetime.date(2021, 1, 1), datetime.date(2021, 1, 4)),
+            CrossrefPartition(datetime.date(2021, 1, 5), datetime.date(2021, 1, 7)),
+            CrossrefPartition(datetime.date(2021, 1, 8), datetime.date(2021, 1, 10)),
+        ])
+
+    def test_no_more_partitions_than_days(self):
+        partitions = date_partitions(datetime.date(2021, 1, 1), datetime.date(2021, 1, 2), 5)
+        assert_equals(partitions, [
+            CrossrefPartition(datetime.date(2021, 1, 1), datetime.date(2021, 1, 1)),
+            CrossrefPartition(datetime.date(2021, 1, 2), datetime.date(2021, 1, 2)),
+        ])
+
+
+class TestIngestPartitions(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = HTTPServer(('127.0.0.1', 0), CannedCrossref)
+        cls.api_url = 'http://127.0.0.1:{}'.format(cls.server.server_port)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+
+    def setUp(self):
+        CannedCrossref.pages = {
+            canned_filter('2021-01-01', '2021-01-02'): {
+                '*': (['10.1/a1', '10.1/a2'], 'a-page-2'),
+                'a-page-2': (['10.1/a3'], 'a-page-3'),
+                'a-page-3': ([], 'a-page-4'),
+            },
+            canned_filter('2021-01-03', '2021-01-04'): {
+                '*': (['10.1/b1'], 'b-page-2'),
+                'b-page-2': ([], None),
+            },
+        }
+        CannedCrossref.requests = []
+        self.inserted = []
+        self.partitions = date_partitions(datetime.date(2021, 1, 1), datetime.date(2021, 1, 4), 2)
+
+    def ingest_open_range(self, checkpoints, **kwargs):
+        today = datetime.date.today()
+        open_partition = CrossrefPartition(today, today + datetime.timedelta(days=1))
+        CannedCrossref.pages[canned_filter(open_partition.first, open_partition.last)] = {
+            '*': (['10.1/c1'], 'c-page-2'),
+            'c-page-2': ([], None),
+        }
+        return ingest_crossref_partitions(
+            [open_partition],
+            concurrency=1,
+            insert_pub_fn=self.insert_pubs,
+            checkpoints=checkpoints,
+            api_url=self.api_url,
+            seconds_between_requests=0,
+            **kwargs
+        )
+
+    def insert_pubs(self, pubs):
+        self.inserted.extend(p.id for p in pubs)
+        return pubs
+
+    def ingest(self, checkpoints):
+        return ingest_crossref_partitions(
+            self.partitions,
+            concurrency=2,
+            insert_pub_fn=self.insert_pubs,
+            checkpoints=checkpoints,
+            api_url=self.api_url,
+            seconds_between_requests=0
+        )
+
+    def test_ingests_every_partition(self):
+        checkpoints = MemoryCheckpoints()
+        num_added = self.ingest(checkpoints)
+
+        assert_equals(num_added, 4)
+        assert_equals(sorted(self.inserted), ['10.1/a1', '10.1/a2', '10.1/a3', '10.1/b1'])
+        assert_equals(checkpoints.checkpoints, {
+            partition_key(self.partitions[0], False): ('a-page-4', True),
+            partition_key(self.partitions[1], False): (None, True),
+        })
+
+    def test_resumes_from_checkpoints(self):
+        checkpoints = MemoryCheckpoints({
+            partition_key(self.partitions[0], False): ('a-page-2', False),
+            partition_key(self.partitions[1], False): (None, True),
+        })
+        self.ingest(checkpoints)
+
+        assert_equals(sorted(self.inserted), ['10.1/a3'])
+        assert_equals(
+            CannedCrossref.requests,
+            [(canned_filter('2021-01-01', '2021-01-02'), 'a-page-2'), (canned_filter('2021-01-01', '2021-01-02'), 'a-page-3')]
+        )
+
+    def test_rewalks_done_partition_that_includes_today(self):
+        checkpoints = MemoryCheckpoints()
+        self.ingest_open_range(checkpoints)
+        self.ingest_open_range(checkpoints)
+
+        assert_equals(self.inserted, ['10.1/c1', '10.1/c1'])
+
+    def test_ignore_checkpoints(self):
+        checkpoints = MemoryCheckpoints()
+        self.ingest(checkpoints)
+        self.inserted = []
+
+        ingest_crossref_partitions(
+            self.partitions,
+            concurrency=2,
+            insert_pub_fn=self.insert_pubs,
+            checkpoints=checkpoints,
+            api_url=self.api_url,
+            seconds_between_requests=0,
+            ignore_checkpoints=True
+        )
+
+        assert_equals(sorted(self.inserted), ['10.1/a1', '10.1/a2', '10.1/a3', '10.1/b1'])
+
+    def test_failed_insert_does_not_advance_checkpoint(self):
+        def fail_on_a3(pubs):
+            if '10.1/a3' in [p.id for p in pubs]:
+                raise RuntimeError('failed committing {} new pubs'.format(len(pubs)))
+            return self.insert_pubs(pubs)
+
+        checkpoints = MemoryCheckpoints()
+        ingest_crossref_partitions(
+            self.partitions,
+            concurrency=2,
+            insert_pub_fn=fail_on_a3,
+            checkpoints=checkpoints,
+            api_url=self.api_url,
+            seconds_between_requests=0
+        )
+
+        assert_equals(checkpoints.checkpoints[partition_key(self.partitions[0], False)], ('a-page-2', False))
+
+        self.inserted = []
+        self.ingest(checkpoints)
+        assert_equals(sorted(self.inserted), ['10.1/a3'])
+
+    def test_restarts_partition_when_saved_cursor_expired(self):
+        checkpoints = MemoryCheckpoints({
+            partition_key(self.partitions[0], False): ('expired-cursor', False),
+            partition_key(self.partitions[1], False): (None, True),
+        })
+        self.ingest(checkpoints)
+
+        assert_equals(sorted(self.inserted), ['10.1/a1', '10.1/a2', '10.1/a3'])
@@ -0,0 +1,43 @@
+import os
+import unittest
+
+import mock
+from nose.tools import assert_equals
+
+from app import db_pool_mode
+from app import db_pool_setting
+
+
+class TestDbPoolSetting(unittest.TestCase):
+    def setUp(self):
+        environ = mock.patch.dict(os.environ)
+        environ.start()
+        self.addCleanup(environ.stop)
+        for name in ["DYNO", "DB_POOL_MODE", "DB_POOL_MODE_WEB", "DB_POOL_MODE_WORKER"]:
+            os.environ.pop(name, None)
+
+    def test_default(self):
+        assert_equals(db_pool_mode(), "null")
+        assert_equals(db_pool_setting("DB_POOL_SIZE", 5), 5)
+
+    def test_global_setting(self):
+        os.environ["DB_POOL_MODE"] = "queue"
+        assert_equals(db_pool_mode(), "queue")
+
+    def test_web_setting_overrides_global_on_web_dynos(self):
+        os.environ.update({"DB_POOL_MODE": "null", "DB_POOL_MODE_WEB": "queue", "DB_POOL_MODE_WORKER": "null"})
+
+        os.environ["DYNO"] = "web.1"
+        assert_equals(db_pool_mode(), "queue")
+
+        os.environ["DYNO"] = "refresh.3"
+        assert_equals(db_pool_mode(), "null")
+
+    def test_worker_setting_overrides_global_on_workers(self):
+        os.environ.update({"DB_POOL_MODE": "null", "DB_POOL_MODE_WORKER": "queue"})
+
+        os.environ["DYNO"] = "refresh.3"
+        assert_equals(db_pool_mode(), "queue")
+
+        os.environ["DYNO"] = "web.1"
+        assert_equals(db_pool_mode(), "null")
@@ -0,0 +1,71 @@
+import pickle
+import unittest
+from datetime import datetime, timedelta
+
+from nose.tools import assert_equals
+
+from host_scheduler import HostScheduler, ScrapeJob
+
+
+class FakeRedis(object):
+    def __init__(self, values=None):
+        self.values = values or {}
+
+    def mget(self, keys):
+        return [self.values.get(key) for key in keys]
+
+
+class FakeClock(object):
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class TestHostScheduler(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock(datetime(2020, 1, 1, 12, 0, 0))
+
+    def schedule(self, jobs, redis_values=None, max_wait_seconds=60):
+        scheduler = HostScheduler(FakeRedis(redis_values), clock=self.clock, max_wait_seconds=max_wait_seconds)
+        return scheduler.schedule(jobs)
+
+    def test_interleaves_hosts(self):
+        jobs = [
+            ScrapeJob('a1', 'a:', 10),
+            ScrapeJob('a2', 'a:', 10),
+            ScrapeJob('a3', 'a:', 10),
+            ScrapeJob('b1', 'b:', 10),
+            ScrapeJob('b2', 'b:', 10),
+        ]
+        scheduled, deferred = self.schedule(jobs)
+
+        assert_equals([j.item for j in scheduled], ['a1', 'b1', 'a2', 'b2', 'a3'])
+        assert_equals(scheduled[0].not_before, self.clock.now)
+        assert_equals(scheduled[2].not_before, self.clock.now + timedelta(seconds=10))
+        assert_equals(deferred, [])
+
+    def test_starts_after_redis_started_time(self):
+        redis_values = {
+            'a:started': pickle.dumps(self.clock.now - timedelta(seconds=4)),
+            'b:started': pickle.dumps(None),
+        }
+        scheduled, deferred = self.schedule([ScrapeJob('a1', 'a:', 10), ScrapeJob('b1', 'b:', 10)], redis_values)
+
+        assert_equals([j.item for j in scheduled], ['b1', 'a1'])
+        assert_equals(scheduled[1].not_before, self.clock.now + timedelta(seconds=6))
+
+    def test_defers_jobs_past_max_wait(self):
+        jobs = [ScrapeJob('a{}'.format(i), 'a:', 10) for i in range(10)]
+        scheduled, deferred = self.schedule(jobs, max_wait_seconds=30)
+
+        assert_equals([j.item for j in scheduled], ['a0', 'a1', 'a2', 'a3'])
+        assert_equals(deferred, ['a4', 'a5', 'a6', 'a7', 'a8', 'a9'])
+
+    def test_unlimited_hosts_are_all_ready(self):
+        jobs = [ScrapeJob('p{}'.format(i), 'p:', 0) for i in range(5)]
+        scheduled, deferred = self.schedule(jobs)
+
+        assert_equals([j.not_before for j in scheduled], [self.clock.now] * 5)
+        assert_equals(deferred, [])
@@ -1,3 +1,4 @@
+import json
 import unittest
 
 import mock
@@ -712,3 +713,50 @@ class TestDecideIfOpen(unittest.TestCase):
             p = pub.Pub(id='test_pub')
             p.decide_if_open()
             assert_equals(p.oa_status, OAStatus.bronze)
+
+
+class TestHasChanged(unittest.TestCase):
+    def setUp(self):
+        self.old_response = {
+            "doi": "10.1234/abc",
+            "data_standard": 1,
+            "updated": "2020-01-01T00:00:00",
+            "is_oa": True,
+            "oa_locations": [
+                {"updated": "2020-01-01T00:00:00", "url": "http://example.com/a.pdf", "is_best": True},
+            ],
+            "oa_locations_embargoed": [],
+            "z_authors": [{"family": "Smith"}],
+        }
+
+    def new_pub(self, response):
+        p = pub.Pub(id='10.1234/abc')
+        p.response_jsonb = response
+        return p
+
+    def test_ignored_keys_dont_count(self):
+        new_response = json.loads(json.dumps(self.old_response))
+        new_response["data_standard"] = 2
+        new_response["updated"] = "2021-01-01T00:00:00"
+        new_response["oa_locations"][0]["updated"] = "2021-01-01T00:00:00"
+        new_response["z_authors"] = [{"family": "Jones"}]
+
+        p = self.new_pub(new_response)
+        assert_false(p.has_changed(self.old_response, pub.Pub.ignored_keys_for_external_diff(),
+                                   pub.Pub.ignored_top_level_keys_for_external_diff()))
+        assert_true(p.has_changed(self.old_response, pub.Pub.ignored_keys_for_internal_diff(), []))
+
+    def test_changed_paths(self):
+        new_response = json.loads(json.dumps(self.old_response))
+        new_response["oa_locations"][0]["url"] = "http://example.com/b.pdf"
+
+        p = self.new_pub(new_response)
+        assert_true(p.has_changed(self.old_response, pub.Pub.ignored_keys_for_external_diff(),
+                                  pub.Pub.ignored_top_level_keys_for_external_diff()))
+        assert_equals(
+            pub.Pub.response_diff(new_response, self.old_response, pub.Pub.ignored_keys_for_internal_diff(), []),
+            ["oa_locations.0.url"]
+        )
+
+    def test_no_old_response(self):
+        assert_true(self.new_pub(self.old_response).has_changed(None, [], []))
@@ -0,0 +1,64 @@
+import unittest
+from threading import Thread
+
+import fakeredis
+from nose.tools import assert_equals
+
+from rate_limit import RateLimiter
+
+
+class FakeClock(object):
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class TestRateLimiter(unittest.TestCase):
+    def setUp(self):
+        self.redis_client = fakeredis.FakeRedis()
+        self.clock = FakeClock(1000.0)
+        self.rate_limiter = RateLimiter(self.redis_client, clock=self.clock)
+
+    def test_requests_over_allowance_are_limited(self):
+        results = [self.rate_limiter.too_many_requests('1.2.3.4', 3, 600) for _ in range(5)]
+        assert_equals(results, [False, False, False, True, True])
+        assert_equals(self.rate_limiter.too_many_requests('5.6.7.8', 3, 600), False)
+
+    def test_request_bucket_expires(self):
+        self.rate_limiter.too_many_requests('1.2.3.4', 3, 600)
+        assert self.redis_client.ttl('1.2.3.4') > 0
+
+    def test_concurrent_requests_share_allowance(self):
+        results = []
+
+        def make_requests():
+            for _ in range(50):
+                results.append(self.rate_limiter.too_many_requests('1.2.3.4', 100, 600))
+
+        threads = [Thread(target=make_requests) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert_equals(results.count(False), 100)
+
+    def test_too_many_members(self):
+        results = [
+            self.rate_limiter.too_many_members('ip-emails', 'user{}@example.com'.format(i), 3, 300)
+            for i in range(5)
+        ]
+        assert_equals(results, [False, False, False, True, True])
+
+    def test_repeat_member_counts_once(self):
+        for _ in range(5):
+            assert_equals(self.rate_limiter.too_many_members('ip-emails', 'user@example.com', 3, 300), False)
+
+    def test_members_leave_window(self):
+        for i in range(4):
+            self.rate_limiter.too_many_members('ip-emails', 'user{}@example.com'.format(i), 3, 300)
+
+        self.clock.now += 301
+        assert_equals(self.rate_limiter.too_many_members('ip-emails', 'late@example.com', 3, 300), False)
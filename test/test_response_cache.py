@@ -0,0 +1,104 @@
+import unittest
+
+import fakeredis
+import mock
+from nose.tools import assert_equals
+
+import endpoint  # magic
+import pub
+import response_cache
+from response_cache import DEFAULT_VARIANT, SKIP_ALL_HYBRID_VARIANT
+from response_cache import LruResponseStore, RedisResponseStore, ResponseCache
+
+
+class FakeClock(object):
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class TestLruResponseStore(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock(1000.0)
+        self.cache = ResponseCache(LruResponseStore(maxsize=2, ttl_seconds=300, clock=self.clock))
+
+    def test_responses_expire_after_ttl(self):
+        self.cache.set('10.1/a', DEFAULT_VARIANT, '{"doi": "10.1/a"}')
+
+        self.clock.now += 299
+        assert_equals(self.cache.get('10.1/a', DEFAULT_VARIANT), '{"doi": "10.1/a"}')
+
+        self.clock.now += 2
+        assert_equals(self.cache.get('10.1/a', DEFAULT_VARIANT), None)
+
+    def test_least_recently_used_response_is_evicted(self):
+        self.cache.set('10.1/a', DEFAULT_VARIANT, 'a')
+        self.cache.set('10.1/b', DEFAULT_VARIANT, 'b')
+        self.cache.get('10.1/a', DEFAULT_VARIANT)
+        self.cache.set('10.1/c', DEFAULT_VARIANT, 'c')
+
+        assert_equals(self.cache.get('10.1/a', DEFAULT_VARIANT), 'a')
+        assert_equals(self.cache.get('10.1/b', DEFAULT_VARIANT), None)
+
+
+class TestResponseCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = ResponseCache(RedisResponseStore(fakeredis.FakeRedis(), ttl_seconds=300))
+
+    def test_counts_hits_and_misses(self):
+        self.cache.get('10.1/a', DEFAULT_VARIANT)
+        self.cache.set('10.1/a', DEFAULT_VARIANT, 'a')
+        self.cache.get('10.1/a', DEFAULT_VARIANT)
+        self.cache.get('10.1/a', DEFAULT_VARIANT)
+        self.cache.get('10.1/a', SKIP_ALL_HYBRID_VARIANT)
+
+        assert_equals(self.cache.stats(), {'hits': 2, 'misses': 2, 'hit_rate': 0.5})
+
+    def test_invalidate_removes_every_variant(self):
+        self.cache.set('10.1/a', DEFAULT_VARIANT, 'a')
+        self.cache.set('10.1/a', SKIP_ALL_HYBRID_VARIANT, 'a skip hybrid')
+        self.cache.set('10.1/b', DEFAULT_VARIANT, 'b')
+        self.cache.invalidate('10.1/a')
+
+        assert_equals(self.cache.get('10.1/a', DEFAULT_VARIANT), None)
+        assert_equals(self.cache.get('10.1/a', SKIP_ALL_HYBRID_VARIANT), None)
+        assert_equals(self.cache.get('10.1/b', DEFAULT_VARIANT), 'b')
+
+    def test_store_errors_are_misses(self):
+        self.cache.store = mock.Mock(get=mock.Mock(side_effect=Exception('redis is down')))
+        assert_equals(self.cache.get('10.1/a', DEFAULT_VARIANT), None)
+        assert_equals(self.cache.stats()['misses'], 1)
+
+
+class TestInvalidateOnRefresh(unittest.TestCase):
+    def setUp(self):
+        self.cache = ResponseCache(LruResponseStore(maxsize=10, ttl_seconds=300))
+        self.cache.set('10.1/a', DEFAULT_VARIANT, '{"doi": "10.1/a", "is_oa": false}')
+
+        get_response_cache = mock.patch.object(response_cache, 'get_response_cache', return_value=self.cache)
+        get_response_cache.start()
+        self.addCleanup(get_response_cache.stop)
+
+        # everything recalculate_and_store does besides deciding whether the response changed
+        for method in ['recalculate', 'set_results', 'mint_pages', 'scrape_green_locations',
+                       'store_or_remove_pdf_urls_for_validation', 'store_refresh_priority',
+                       'store_preprint_relationships', 'store_retractions']:
+            patcher = mock.patch.object(pub.Pub, method)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.my_pub = pub.Pub(id='10.1/a', crossref_api_raw_new={}, rand=0.5)
+
+    def recalculate_and_store(self, response_changed):
+        with mock.patch.object(pub.Pub, 'decide_if_response_changed', return_value=response_changed):
+            return self.my_pub.recalculate_and_store()
+
+    def test_changed_response_is_invalidated(self):
+        self.recalculate_and_store(response_changed=True)
+        assert_equals(self.cache.get('10.1/a', DEFAULT_VARIANT), None)
+
+    def test_unchanged_response_stays_cached(self):
+        self.recalculate_and_store(response_changed=False)
+        assert_equals(self.cache.get('10.1/a', DEFAULT_VARIANT), '{"doi": "10.1/a", "is_oa": false}')
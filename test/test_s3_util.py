@@ -0,0 +1,51 @@
+import unittest
+
+import boto3
+from moto import mock_s3
+from nose.tools import assert_equals
+from nose.tools import assert_false
+from nose.tools import assert_true
+
+from s3_util import check_exists, existing_keys
+
+BUCKET = 'test-bucket'
+
+
+@mock_s3
+class TestS3Exists(unittest.TestCase):
+    def setUp(self):
+        self.s3 = boto3.client('s3', region_name='us-east-1')
+        self.s3.create_bucket(Bucket=BUCKET)
+
+    def put(self, keys):
+        for key in keys:
+            self.s3.put_object(Bucket=BUCKET, Key=key, Body=b'%PDF-1.4')
+
+    def test_check_exists(self):
+        self.put(['10.1234%2Fabc.pdf'])
+        assert_true(check_exists(BUCKET, '10.1234%2Fabc.pdf', s3=self.s3))
+        assert_false(check_exists(BUCKET, '10.1234%2Fabd.pdf', s3=self.s3))
+
+    def test_existing_keys(self):
+        stored = ['10.1234%2F{:04d}.pdf'.format(i) for i in range(0, 3000, 2)] + ['accepted_10.1234%2F0001.pdf']
+        self.put(stored)
+
+        keys = ['10.1234%2F{:04d}.pdf'.format(i) for i in range(0, 3000, 7)] + [
+            'accepted_10.1234%2F0001.pdf',
+            'accepted_10.1234%2F0002.pdf',
+            '10.9999%2Fmissing.pdf',
+        ]
+
+        assert_equals(existing_keys(BUCKET, keys, s3=self.s3), set(keys) & set(stored))
+
+    def test_existing_keys_sparse(self):
+        stored = ['10.1234%2F{:05d}.pdf'.format(i) for i in range(2000)]
+        self.put(stored)
+
+        keys = ['10.1234%2F{:05d}.pdf'.format(i) for i in [5, 700, 1400]] + ['10.1234%2F99999.pdf']
+
+        assert_equals(existing_keys(BUCKET, keys, s3=self.s3, max_keys=10), set(keys) & set(stored))
+
+    def test_existing_keys_empty(self):
+        assert_equals(existing_keys(BUCKET, [], s3=self.s3), set())
+        assert_equals(existing_keys(BUCKET, ['nothing.pdf'], s3=self.s3), set())
@@ -0,0 +1,82 @@
+import os
+import unittest
+
+from nose.tools import assert_in
+from sqlalchemy import create_engine, sql
+
+from search import AUTOCOMPLETE_SQL, FULLTEXT_SEARCH_SQL
+from search import like_pattern_contains
+
+# EXPLAINs the search queries against fixture tables in a scratch schema.
+# point TEST_DATABASE_URL at a disposable postgres 12+ database to run these.
+TEST_DATABASE_URL = os.getenv('TEST_DATABASE_URL')
+
+MIGRATION_FILE = os.path.join(os.path.dirname(__file__), '..', 'sql', 'title_search.sql')
+
+FIXTURE_TITLES = [
+    'Open access publishing in astrophysics',
+    'Gene expression in zebrafish embryos',
+    'Machine learning for protein folding',
+    'Climate models and ocean circulation',
+]
+
+
+def migration_statements():
+    # concurrent index builds can't share a transaction, so run each statement on its own
+    with open(MIGRATION_FILE) as f:
+        lines = [line for line in f if not line.strip().startswith('--')]
+    return [statement.strip() for statement in ''.join(lines).split(';') if statement.strip()]
+
+
+@unittest.skipUnless(TEST_DATABASE_URL, 'TEST_DATABASE_URL is not set')
+class TestSearchIndexes(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.engine = create_engine(TEST_DATABASE_URL, isolation_level='AUTOCOMMIT')
+        with cls.engine.connect() as conn:
+            conn.execute(sql.text('drop schema if exists search_index_test cascade'))
+            conn.execute(sql.text('create schema search_index_test'))
+            conn.execute(sql.text('set search_path to search_index_test, public'))
+            conn.execute(sql.text('create table pub (id text primary key, title text, response_is_oa boolean)'))
+            conn.execute(sql.text('create table pub_2018 (id text primary key, title text)'))
+
+            for table in ['pub', 'pub_2018']:
+                conn.execute(sql.text(
+                    'insert into {} (id, title) '
+                    'select \'10.1234/\' || n, (:titles_array)[1 + n % 4] || \' \' || n '
+                    'from generate_series(1, 5000) n'.format(table)
+                ).bindparams(titles_array=FIXTURE_TITLES))
+
+            for statement in migration_statements():
+                conn.execute(sql.text(statement))
+
+            conn.execute(sql.text('analyze pub'))
+            conn.execute(sql.text('analyze pub_2018'))
+
+    @classmethod
+    def tearDownClass(cls):
+        with cls.engine.connect() as conn:
+            conn.execute(sql.text('drop schema if exists search_index_test cascade'))
+        cls.engine.dispose()
+
+    def explain(self, query_text, **params):
+        with self.engine.connect() as conn:
+            conn.execute(sql.text('set search_path to search_index_test, public'))
+            conn.execute(sql.text('set enable_seqscan = off'))
+            rows = conn.execute(sql.text('explain ' + query_text.strip()).bindparams(**params)).fetchall()
+        return '\n'.join(row[0] for row in rows)
+
+    def test_fulltext_search_uses_tsvector_index(self):
+        plan = self.explain(FULLTEXT_SEARCH_SQL.format(oa_clause='true', offset=0), search_str='zebrafish embryos')
+        assert_in('pub_title_tsv_idx', plan)
+
+    def test_autocomplete_uses_trigram_index(self):
+        plan = self.explain(
+            AUTOCOMPLETE_SQL,
+            p0=like_pattern_contains('protein'),
+            p1=r'(protein\w*?\M)',
+            p2=r'(protein\w*?(?:\s+\w+){1})\M',
+            p3=r'(protein\w*?(?:\s+\w+){2})\M',
+            p4=r'(protein\w*?(?:\s+\w+){3}|)\M',
+        )
+        assert_in('pub_2018_title_trgm_idx', plan)
@@ -0,0 +1,90 @@
+import glob
+import json
+import os
+import unittest
+
+from lxml import etree
+from nose.tools import assert_equals
+
+import webpage
+
+FIXTURE_DIR = os.path.join(os.path.dirname(__file__), 'fixtures', 'webpages')
+
+# useful_links.json was recorded from get_useful_links before the section finders were compiled
+
+
+def fixture_pages():
+    for path in sorted(glob.glob(os.path.join(FIXTURE_DIR, '*.html'))):
+        with open(path) as f:
+            yield os.path.basename(path), f.read()
+
+
+def link_summary(links):
+    return [[l.href, l.anchor, webpage.has_bad_href_word(l.href), webpage.has_bad_anchor_word(l.anchor)] for l in links]
+
+
+def clear_sections_one_at_a_time(tree, section_finders):
+    # the uncompiled way: evaluate each finder string in order, clearing as we go
+    for section_finder in section_finders:
+        for bad_section in tree.xpath(section_finder):
+            bad_section.clear()
+
+
+def clear_sections_compiled(tree, compiled_finders):
+    for section_finder in compiled_finders:
+        for bad_section in section_finder(tree):
+            bad_section.clear()
+
+
+def has_word(words, text):
+    return any(word.lower() in text.lower() for word in words)
+
+
+class TestUsefulLinks(unittest.TestCase):
+    def test_links_match_recorded_corpus(self):
+        with open(os.path.join(FIXTURE_DIR, 'useful_links.json')) as f:
+            expected = json.load(f)
+
+        pages = dict(fixture_pages())
+        assert_equals(sorted(pages.keys()), sorted(expected.keys()))
+
+        for name, html in pages.items():
+            assert_equals(link_summary(webpage.get_useful_links(html)), expected[name], name)
+
+    def test_compiled_link_finders_clear_the_same_sections(self):
+        for name, html in fixture_pages():
+            parsed_page = webpage.ParsedPage(html)
+            one_at_a_time, compiled = parsed_page.tree_copy(), parsed_page.tree_copy()
+
+            clear_sections_one_at_a_time(one_at_a_time, webpage.link_bad_section_finders())
+            clear_sections_compiled(compiled, webpage._bad_link_section_finders)
+
+            assert_equals(etree.tostring(compiled), etree.tostring(one_at_a_time), name)
+
+    def test_compiled_license_finders_clear_the_same_sections(self):
+        for name, html in fixture_pages():
+            parsed_page = webpage.ParsedPage(html)
+            one_at_a_time, compiled = parsed_page.tree_copy(), parsed_page.tree_copy()
+
+            clear_sections_one_at_a_time(one_at_a_time, webpage.license_bad_section_finders())
+            clear_sections_compiled(compiled, webpage._bad_license_section_finders)
+
+            assert_equals(etree.tostring(compiled), etree.tostring(one_at_a_time), name)
+
+    def test_word_regexes_match_word_lists(self):
+        texts = []
+        for name, html in fixture_pages():
+            for link in webpage.ParsedPage(html).tree.xpath('//a'):
+                texts.append(link.attrib.get('href', ''))
+                texts.append(link.text_content())
+
+        words = webpage.bad_href_words() + webpage.good_href_words() + webpage.bad_anchor_words()
+        texts += words + [word.upper() for word in words] + ['/x/{}/y'.format(word.title()) for word in words]
+
+        for text in texts:
+            expected_bad_href = (
+                not has_word(webpage.good_href_words(), text)
+                and (has_word(webpage.bad_href_words(), text) or bool(webpage._bad_href_pattern_re.search(text)))
+            )
+            assert_equals(webpage.has_bad_href_word(text), expected_bad_href, text)
+            assert_equals(webpage.has_bad_anchor_word(text), has_word(webpage.bad_anchor_words(), text), text)
@@ -3,10 +3,12 @@ import collections
 import datetime
 import logging
 import math
+import multiprocessing
 import os
 import re
 import time
 import unicodedata
+from multiprocessing.connection import wait
 from urllib.parse import urljoin
 
 import heroku3
@@ -639,3 +641,96 @@ def normalize_issn(issn):
 
 def is_same_issn(l, r):
     return normalize_issn(l) == normalize_issn(r)
+
+
+def _timeout_pool_worker_main(fn, conn):
+    while True:
+        try:
+            item = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            return
+
+        try:
+            result = fn(item)
+        except Exception:
+            logging.exception("exception in pool worker")
+            result = None
+
+        conn.send(result)
+
+
+class _TimeoutPoolWorker(object):
+    def __init__(self, fn):
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=_timeout_pool_worker_main, args=(fn, child_conn), daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    def stop(self, kill=False):
+        # closing our end of the pipe tells an idle worker to exit
+        self.conn.close()
+        if kill:
+            self.process.terminate()
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+
+
+class TimeoutProcessPool(object):
+    """Long-lived worker processes that run fn on one item at a time.
+
+    Unlike ProcessPoolExecutor, a worker that runs past timeout_seconds can be killed:
+    its item gets None and a fresh worker takes its place, so a process per item isn't needed
+    to enforce the timeout. The workers are forked, so don't hold db connections when making or using one.
+    """
+
+    def __init__(self, fn, num_workers, timeout_seconds):
+        self.fn = fn
+        self.timeout_seconds = timeout_seconds
+        self.workers = [_TimeoutPoolWorker(fn) for _ in range(num_workers)]
+
+    def replace_worker(self, worker):
+        worker.stop(kill=True)
+        self.workers.remove(worker)
+        self.workers.append(_TimeoutPoolWorker(self.fn))
+
+    def map(self, items):
+        results = [None] * len(items)
+        pending = collections.deque(enumerate(items))
+        idle = list(self.workers)
+        busy = {}  # worker -> (item index, deadline)
+
+        while pending or busy:
+            while pending and idle:
+                worker = idle.pop()
+                index, item = pending.popleft()
+                worker.conn.send(item)
+                busy[worker] = (index, time.time() + self.timeout_seconds)
+
+            next_deadline = min(deadline for index, deadline in busy.values())
+            ready_conns = wait([worker.conn for worker in busy], timeout=max(0, next_deadline - time.time()))
+
+            for worker in list(busy):
+                index, deadline = busy[worker]
+                if worker.conn in ready_conns:
+                    del busy[worker]
+                    try:
+                        results[index] = worker.conn.recv()
+                        idle.append(worker)
+                    except EOFError:
+                        logging.error("pool worker {} exited on item {}".format(worker.process.pid, index))
+                        self.replace_worker(worker)
+                        idle.append(self.workers[-1])
+                elif deadline <= time.time():
+                    del busy[worker]
+                    logging.error("pool worker {} timed out on item {}".format(worker.process.pid, index))
+                    self.replace_worker(worker)
+                    idle.append(self.workers[-1])
+
+        return results
+
+    def close(self):
+        for worker in self.workers:
+            worker.stop()
+        self.workers = []
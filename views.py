@@ -2,13 +2,13 @@ import json
 import os
 import re
 import sys
+import tempfile
 from collections import defaultdict, OrderedDict
 from datetime import date, datetime, timedelta
 from time import time
 
 import boto
 import redis
-import unicodecsv
 from flask import Response
 from flask import abort
 from flask import current_app
@@ -18,8 +18,8 @@ from flask import make_response
 from flask import redirect
 from flask import render_template
 from flask import request
+from flask import stream_with_context
 from flask import url_for
-from openpyxl import Workbook
 from sqlalchemy import sql
 from sqlalchemy.orm import raiseload
 from urllib.parse import quote
@@ -31,10 +31,12 @@ import repository
 from app import app
 from app import db
 from app import logger
+from bulk_lookup import BulkLookupFiles
+from bulk_lookup import write_bulk_lookup_files
 from changefile import DAILY_FEED, WEEKLY_FEED
 from changefile import get_changefile_dicts
 from changefile import get_file_from_bucket
-from changefile import valid_changefile_api_keys
+from changefile import is_valid_changefile_api_key
 from emailer import create_email
 from emailer import send
 from endpoint import Endpoint
@@ -44,17 +46,20 @@ from page import LANDING_PAGE_ARCHIVE_BUCKET as REPO_PAGE_ARCHIVE_BUCKET
 from page import PageNew
 from pmh_record import PmhRecord
 from put_repo_requests_in_db import add_endpoint
+from rate_limit import RateLimiter
 from recordthresher.pubmed import PubmedRaw
 from repo_oa_location_export_request import RepoOALocationExportRequest
 from repo_pulse import BqRepoPulse
 from repo_request import RepoRequest
 from repository import Repository
+from response_cache import DEFAULT_VARIANT, SKIP_ALL_HYBRID_VARIANT
+from response_cache import get_response_cache
 from search import autocomplete_phrases
 from search import fulltext_search_title
 from snapshot import get_daily_snapshot_key
 from static_api_response import StaticAPIResponse
 from util import NoDoiException
-from util import clean_doi, normalize_doi
+from util import normalize_doi
 from util import elapsed
 from util import restart_dynos
 from util import str_to_bool
@@ -182,7 +187,7 @@ def stuff_before_request():
         api_key = request.args.get("api_key", None)
 
         if api_key:
-            if api_key not in valid_changefile_api_keys():
+            if not is_valid_changefile_api_key(api_key):
                 abort_json(403, "Invalid api_key")
         else:
             if not email:
@@ -289,9 +294,9 @@ def stuff_before_request():
 
 
 def too_many_emails_per_ip(ip, email):
-    redis_client = get_redis_client()
+    rate_limiter = get_rate_limiter()
 
-    if not redis_client:
+    if not rate_limiter:
         return False
 
     max_emails_per_ip = 20
@@ -299,19 +304,13 @@ def too_many_emails_per_ip(ip, email):
 
     redis_key = f'v2-api-ip-emails:{ip}'
 
-    redis_client.zremrangebyscore(redis_key, 0, time() - window_seconds)
-    redis_client.zadd(redis_key, {email: time()})
-    redis_client.expire(redis_key, window_seconds)
-
-    emails_per_ip = redis_client.zcard(redis_key)
-
-    return emails_per_ip > max_emails_per_ip
+    return rate_limiter.too_many_members(redis_key, email, max_emails_per_ip, window_seconds)
 
 
 def too_many_requests_per_second(ip):
-    redis_client = get_redis_client()
+    rate_limiter = get_rate_limiter()
 
-    if not redis_client:
+    if not rate_limiter:
         return False
 
     per_second = 4
@@ -319,17 +318,12 @@ def too_many_requests_per_second(ip):
     limit = minutes * per_second * 60
     period = timedelta(minutes=minutes)
 
-    if redis_client.setnx(ip, limit):
-        redis_client.expire(ip, int(period.total_seconds()))
-    bucket_val = redis_client.get(ip)
-    if bucket_val and int(bucket_val) > 0:
-        redis_client.decrby(ip, 1)
-        return False
-    return True
+    return rate_limiter.too_many_requests(ip, limit, period.total_seconds())
 
 
 _redis_client = None
 _redis_init = False
+_rate_limiter = None
 
 
 def get_redis_client():
@@ -337,7 +331,12 @@ def get_redis_client():
 
     if not _redis_init:
         try:
-            _redis_client = redis.from_url(os.environ.get("REDIS_URL"), max_connections=1)
+            # one connection per request thread, and threads wait for a free one instead of failing
+            pool = redis.BlockingConnectionPool.from_url(
+                os.environ.get("REDIS_URL"),
+                max_connections=int(os.getenv("WEB_THREADS_PER_WORKER", 1))
+            )
+            _redis_client = redis.Redis(connection_pool=pool)
         except Exception as e:
             logger.exception(f'failed creating redis client: {e}')
 
@@ -345,6 +344,17 @@ def get_redis_client():
 
     return _redis_client
 
+
+def get_rate_limiter():
+    global _rate_limiter
+
+    if not _rate_limiter:
+        redis_client = get_redis_client()
+        if redis_client:
+            _rate_limiter = RateLimiter(redis_client)
+
+    return _rate_limiter
+
 # convenience function because we do this in multiple places
 def get_multiple_pubs_response():
     is_person_who_is_making_too_many_requests = False
@@ -374,7 +384,14 @@ def get_multiple_pubs_response():
     if is_person_who_is_making_too_many_requests:
         logger.info("is_person_who_is_making_too_many_requests, so returning 429")
         abort_json(429, "sorry, you are calling us too quickly.  Please email support@unpaywall.org so we can figure out a good way to get you the data you are looking for.")
-    pubs = pub.get_pubs_from_biblio(biblios, run_with_hybrid)
+    if "dois" in body:
+        max_response_age = timedelta(days=int(os.getenv("V1_PUBLICATIONS_MAX_RESPONSE_AGE_DAYS", 7)))
+        pubs = [
+            pub.get_pub_from_doi_with_stored_response(doi, run_with_hybrid, max_response_age=max_response_age)
+            for doi in body["dois"]
+        ]
+    else:
+        pubs = pub.get_pubs_from_biblio(biblios, run_with_hybrid)
     return pubs
 
 
@@ -694,6 +711,23 @@ def get_doi_endpoint(doi):
 @app.route("/v2/<path:doi>", methods=["GET"])
 def get_doi_endpoint_v2(doi):
     # the GET api endpoint (returns json data)
+    indent = None
+    if current_app.config['JSONIFY_PRETTYPRINT_REGULAR'] and not request.is_xhr:
+        indent = 2
+
+    # hybrid requests ask for a fresh scrape, so they always skip the cache
+    response_cache = None if g.hybrid else get_response_cache()
+    cache_doi = normalize_doi(doi, return_none_if_error=True) if response_cache else None
+    cache_variant = SKIP_ALL_HYBRID_VARIANT if "skip_all_hybrid" in request.args else DEFAULT_VARIANT
+    use_cache = cache_doi and request.args.get('email') != 'unpaywall@impactstory.org'
+
+    if use_cache:
+        cached_response = response_cache.get(cache_doi, cache_variant)
+        if cached_response is not None:
+            if indent:
+                cached_response = json.dumps(json.loads(cached_response, object_pairs_hook=OrderedDict), indent=indent)
+            return current_app.response_class(cached_response, mimetype='application/json')
+
     try:
         if request.args.get('email') == 'unpaywall@impactstory.org':
             my_pub = get_pub_from_doi(doi, recalculate=False)
@@ -706,6 +740,8 @@ def get_doi_endpoint_v2(doi):
         else:
             my_pub = get_pub_from_doi(doi)
             answer = my_pub.to_dict_v2()
+            if use_cache:
+                response_cache.set(cache_doi, cache_variant, json.dumps(answer))
     except NoDoiException as e:
         answer = {}
         normalized_doi = normalize_doi(doi, return_none_if_error=True)
@@ -718,10 +754,6 @@ def get_doi_endpoint_v2(doi):
         if not answer:
             abort_json(404, str(e))
 
-    indent = None
-    if current_app.config['JSONIFY_PRETTYPRINT_REGULAR'] and not request.is_xhr:
-        indent = 2
-
     return current_app.response_class(json.dumps(answer, indent=indent), mimetype='application/json')
 
 
@@ -729,76 +761,44 @@ def get_doi_endpoint_v2(doi):
 def simple_query_tool():
     body = request.json
     dirty_dois_list = [d for d in body["dois"] if d]
+    formats = body.get("formats", []) or ["jsonl", "csv"]
+    email_address = body["email"]
+    chunk_size = int(os.getenv("V2_DOIS_CHUNK_SIZE", 1000))
 
-    # look up normalized dois
-    normalized_dois = [n for n in [normalize_doi(d, return_none_if_error=True) for d in dirty_dois_list] if n]
-    q = db.session.query(pub.Pub.response_jsonb).filter(pub.Pub.id.in_(set(normalized_dois)))
-    normalized_doi_responses = dict([(row[0]['doi'], row[0]) for row in q.all() if row[0]])
+    def run_lookup(output_dir):
+        output_files = BulkLookupFiles(output_dir, formats)
+        for progress in write_bulk_lookup_files(dirty_dois_list, output_files, chunk_size):
+            yield progress
 
-    # look up cleaned dois
-    cleaned_dois = [c for c in [clean_doi(d, return_none_if_error=True) for d in dirty_dois_list] if c]
-    q = db.session.query(pub.Pub.response_jsonb).filter(pub.Pub.id.in_(set(cleaned_dois)))
-    cleaned_doi_responses = dict([(row[0]['doi'], row[0]) for row in q.all() if row[0]])
+        files = output_files.close()
 
-    responses = [
-        normalized_doi_responses.get(normalize_doi(d, return_none_if_error=True), None)
-        or cleaned_doi_responses.get(clean_doi(d, return_none_if_error=True), None)
-        or pub.build_new_pub(d, None).to_dict_v2()
-        for d in dirty_dois_list
-    ]
+        # prep email
+        email = create_email(email_address,
+                     "Your Unpaywall results",
+                     "simple_query_tool",
+                     {"profile": {}},
+                     files)
+        send(email, for_real=True)
 
-    formats = body.get("formats", []) or ["jsonl", "csv"]
-    files = []
-
-    if "jsonl" in formats:
-        # save jsonl
-        with open("output.jsonl", 'w') as f:
-            for response_jsonb in responses:
-                f.write(json.dumps(response_jsonb, sort_keys=True))
-                f.write("\n")
-        files.append("output.jsonl")
-
-    csv_dicts = [pub.csv_dict_from_response_dict(my_dict) for my_dict in responses]
-    csv_dicts = [my_dict for my_dict in csv_dicts if my_dict]
-    fieldnames = sorted(csv_dicts[0].keys())
-    fieldnames = ["doi"] + [name for name in fieldnames if name != "doi"]
-
-    if "csv" in formats:
-        # save csv
-        with open("output.csv", 'wb') as f:
-            writer = unicodecsv.DictWriter(f, fieldnames=fieldnames, dialect='excel')
-            writer.writeheader()
-            for my_dict in csv_dicts:
-                writer.writerow(my_dict)
-        files.append("output.csv")
-
-    if "xlsx" in formats:
-        book = Workbook()
-        sheet = book.worksheets[0]
-        sheet.title = "results"
-
-        for col_idx, field_name in enumerate(fieldnames):
-            sheet.cell(column=col_idx+1, row=1, value=field_name)
-
-        for row_idx, row in enumerate(csv_dicts):
-            for col_idx, field_name in enumerate(fieldnames):
-                sheet.cell(column=col_idx+1, row=row_idx+2, value=row[field_name])
-
-        book.save(filename="output.xlsx")
-        files.append("output.xlsx")
-
-    # prep email
-    email_address = body["email"]
-    email = create_email(email_address,
-                 "Your Unpaywall results",
-                 "simple_query_tool",
-                 {"profile": {}},
-                 files)
-    send(email, for_real=True)
+    if str_to_bool(str(body.get("stream", False))):
+        # report progress as json lines while the files are written
+        def generate_progress():
+            with tempfile.TemporaryDirectory(prefix="v2-dois-") as output_dir:
+                for done, total, dois in run_lookup(output_dir):
+                    yield json.dumps({"done": done, "total": total}) + "\n"
+
+            yield json.dumps({"got it": email_address, "done": len(dirty_dois_list)}) + "\n"
+
+        return Response(stream_with_context(generate_progress()), mimetype="application/x-ndjson")
+
+    response_dois = []
+    with tempfile.TemporaryDirectory(prefix="v2-dois-") as output_dir:
+        for done, total, dois in run_lookup(output_dir):
+            response_dois.extend(dois)
 
     return jsonify({
         "got it": email_address,
-        "dois": [r['doi'] for r in responses]
+        "dois": response_dois
     })
 
 
@@ -873,7 +873,7 @@ def get_changefile_filename(filename):
     api_key = request.args.get("api_key", None)
     if not api_key:
         abort_json(401, "You must provide an API_KEY")
-    if api_key not in valid_changefile_api_keys():
+    if not is_valid_changefile_api_key(api_key):
         abort_json(403, "Invalid api_key")
 
     key = get_file_from_bucket(filename)
@@ -894,7 +894,7 @@ def get_snapshot():
     api_key = request.args.get("api_key", None)
     if not api_key:
         abort_json(401, "You must provide an API_KEY")
-    if api_key not in valid_changefile_api_keys():
+    if not is_valid_changefile_api_key(api_key):
         abort_json(403, "Invalid api_key")
 
     key = get_daily_snapshot_key()
@@ -917,7 +917,7 @@ def get_daily_changefile_filename(filename):
     api_key = request.args.get("api_key", None)
     if not api_key:
         abort_json(401, "You must provide an API_KEY")
-    if api_key not in valid_changefile_api_keys():
+    if not is_valid_changefile_api_key(api_key):
         abort_json(403, "Invalid api_key")
 
     key = get_file_from_bucket(filename, feed=DAILY_FEED)
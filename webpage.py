@@ -3,6 +3,7 @@
 
 import os
 import re
+from copy import deepcopy
 from time import time
 from urllib.parse import urlparse
 
@@ -25,6 +26,34 @@ from util import is_same_publisher
 DEBUG_SCRAPING = os.getenv('DEBUG_SCRAPING', False)
 
 
+class ParsedPage(object):
+    """The html of one page, parsed by lxml at most once and shared by all the extractors that need a tree."""
+
+    parse_count = 0  # lxml parses so far in this process
+
+    def __init__(self, text):
+        self.text = text
+        self._tree = None
+        self._is_parsed = False
+        self.useful_links = None
+
+    @property
+    def tree(self):
+        # shared, so don't modify it. extractors that clear sections work on tree_copy().
+        if not self._is_parsed:
+            self._tree = get_tree(self.text)
+            self._is_parsed = True
+            ParsedPage.parse_count += 1
+        return self._tree
+
+    def tree_copy(self):
+        return deepcopy(self.tree) if self.tree is not None else None
+
+
+def as_parsed_page(page):
+    return page if isinstance(page, ParsedPage) else ParsedPage(page)
+
+
 # it matters this is just using the header, because we call it even if the content
 # is too large.  if we start looking in content, need to break the pieces apart.
 def is_pdf_from_header(response):
@@ -50,6 +79,9 @@ def is_pdf_from_header(response):
     return looks_good
 
 
+PDF_SIGNATURE_BYTES = 1024
+
+
 def is_a_pdf_page(response, page_publisher):
     bad_header_publishers = (
         'Addleton Academic Publishers',
@@ -69,6 +101,24 @@ def is_a_pdf_page(response, page_publisher):
             logger.info("response is too big for more checks in is_a_pdf_page")
         return False
 
+    says_free_publisher_patterns = [
+        ("Wiley-Blackwell", '<span class="freeAccess" title="You have free access to this content">'),
+        ("Wiley-Blackwell", '<iframe id="pdfDocument"'),
+        ("JSTOR", r'<li class="download-pdf-button">.*Download PDF.*</li>'),
+        ("Institute of Electrical and Electronics Engineers (IEEE)", r'<frame src="http://ieeexplore.ieee.org/.*?pdf.*?</frameset>'),
+        ("IOP Publishing", r'Full Refereed Journal Article')
+    ]
+
+    publisher_patterns = [
+        pattern for (publisher, pattern) in says_free_publisher_patterns
+        if is_same_publisher(page_publisher, publisher)
+    ]
+
+    # if only the PDF signature can make this a PDF, don't download the whole body to look for it
+    if not publisher_patterns and hasattr(response, 'text_head'):
+        if not re.match("%PDF", response.text_head(PDF_SIGNATURE_BYTES)):
+            return False
+
     content = response.text_big()
 
     # PDFs start with this character
@@ -78,18 +128,9 @@ def is_a_pdf_page(response, page_publisher):
             return False
         return True
 
-    if page_publisher:
-        says_free_publisher_patterns = [
-            ("Wiley-Blackwell", '<span class="freeAccess" title="You have free access to this content">'),
-            ("Wiley-Blackwell", '<iframe id="pdfDocument"'),
-            ("JSTOR", r'<li class="download-pdf-button">.*Download PDF.*</li>'),
-            ("Institute of Electrical and Electronics Engineers (IEEE)", r'<frame src="http://ieeexplore.ieee.org/.*?pdf.*?</frameset>'),
-            ("IOP Publishing", r'Full Refereed Journal Article')
-        ]
-        for (publisher, pattern) in says_free_publisher_patterns:
-            matches = re.findall(pattern, content, re.IGNORECASE | re.DOTALL)
-            if is_same_publisher(page_publisher, publisher) and matches:
-                return True
+    for pattern in publisher_patterns:
+        if re.findall(pattern, content, re.IGNORECASE | re.DOTALL):
+            return True
     return False
 
 
@@ -410,7 +451,8 @@ class Webpage(object):
 
         # logger.info(page)
 
-        links = [get_pdf_in_meta(page)] + [get_pdf_from_javascript(page_with_scripts or page)] + get_useful_links(page)
+        page = as_parsed_page(page)
+        links = [get_pdf_in_meta(page)] + [get_pdf_from_javascript(page_with_scripts or page.text)] + get_useful_links(page)
 
         for link in [x for x in links if x is not None]:
             if DEBUG_SCRAPING:
@@ -670,11 +712,14 @@ class PublisherWebpage(Webpage):
                         logger.info('looks like a full issue index from OJS, skipping full text search')
                         return
 
-            license_search_text = page_potential_license_text(page)
+            # parse the cleaned-up page once for all the extractors below
+            parsed_page = ParsedPage(page)
+
+            license_search_text = page_potential_license_text(parsed_page)
 
             # Look for a pdf link. If we find one, look for a license.
 
-            pdf_download_link = self.find_pdf_link(page) if find_pdf_link else None
+            pdf_download_link = self.find_pdf_link(parsed_page) if find_pdf_link else None
 
             # if we haven't found a pdf yet, try known patterns
             if pdf_download_link is None:
@@ -801,7 +846,7 @@ class PublisherWebpage(Webpage):
                 r'^https?://www\.sciencedirect\.com/science/article/pii/S[0-9X]+/pdf(?:ft)?\?md5=[0-9a-f]+.*[0-9x]+-main.pdf$'
             ]
 
-            citation_pdf_link = get_pdf_in_meta(page)
+            citation_pdf_link = get_pdf_in_meta(parsed_page)
 
             if citation_pdf_link and citation_pdf_link.href:
                 for pattern in bronze_citation_pdf_patterns:
@@ -1132,6 +1177,9 @@ class RepoWebpage(Webpage):
             except Exception as e:
                 logger.error('error parsing html, skipped script removal: {}'.format(e))
 
+            # parse the cleaned-up page once for all the extractors below
+            parsed_page = ParsedPage(page)
+
             # set the license if we can find one
             scraped_license = find_normalized_license(page)
             if scraped_license:
@@ -1159,7 +1207,7 @@ class RepoWebpage(Webpage):
 
             # otherwise look for it the normal way
             else:
-                pdf_download_link = self.find_pdf_link(page, page_with_scripts=page_with_scripts)
+                pdf_download_link = self.find_pdf_link(parsed_page, page_with_scripts=page_with_scripts)
 
             if pdf_download_link is None:
                 if re.search(r'https?://cdm21054\.contentdm\.oclc\.org/digital/collection/IR/id/(\d+)', self.resolved_url):
@@ -1220,7 +1268,7 @@ class RepoWebpage(Webpage):
 
             # try this later because would rather get a pdf
             # if they are linking to a .docx or similar, this is open.
-            doc_link = find_doc_download_link(page)
+            doc_link = find_doc_download_link(parsed_page)
             if doc_link is None and _try_pdf_link_as_doc(self.resolved_url):
                 doc_link = pdf_download_link
 
@@ -1237,7 +1285,7 @@ class RepoWebpage(Webpage):
                     if DEBUG_SCRAPING:
                         logger.info("we've decided this ain't a word doc. [{}]".format(absolute_doc_url))
 
-            bhl_link = find_bhl_view_link(self.resolved_url, page)
+            bhl_link = find_bhl_view_link(self.resolved_url, parsed_page)
             if bhl_link is not None:
                 logger.info('found a BHL document link: {}'.format(get_link_target(bhl_link.href, self.resolved_url)))
                 self.scraped_open_metadata_url = metadata_url
@@ -1352,15 +1400,16 @@ class DuckLink(object):
 
 
 def get_useful_links(page):
-    links = []
-
-    tree = get_tree(page)
-    if tree is None:
-        return []
+    parsed_page = as_parsed_page(page)
+    if parsed_page.useful_links is None:
+        # finding links clears sections of the tree, so work on a copy
+        parsed_page.useful_links = _find_useful_links(parsed_page.tree_copy())
+    return list(parsed_page.useful_links)
 
-    # remove related content sections
 
-    bad_section_finders = [
+def link_bad_section_finders():
+    # sections to remove before looking for links
+    return [
         # references and related content sections
 
         "//div[@class=\'relatedItem\']",  #http://www.tandfonline.com/doi/abs/10.4161/auto.19496
@@ -1428,12 +1477,50 @@ def get_useful_links(page):
         "//tr[@class=\'bookTocEntryRow\']",  # https://www.degruyter.com/document/doi/10.3138/9781487514976/html
     ]
 
-    for section_finder in bad_section_finders:
-        for bad_section in tree.xpath(section_finder):
+
+def _is_self_contained_finder(section_finder):
+    # matches an element by its own tag and attributes only, e.g. //div[@id='toc']
+    return 'text()' not in section_finder and re.match(r"^//[\w-]+(\[[^\[\]/]*\])?$", section_finder)
+
+
+def compile_section_finders(section_finders):
+    # consecutive self-contained finders are merged into one union expression.
+    # clearing what one of them matches can't change what another matches,
+    # so this gives the same result as evaluating them one at a time.
+    # finders that look at text, parents or siblings stay separate and in order.
+    compiled_finders = []
+    union = []
+    for section_finder in section_finders:
+        if _is_self_contained_finder(section_finder):
+            union.append(section_finder)
+        else:
+            if union:
+                compiled_finders.append(etree.XPath(' | '.join(union)))
+                union = []
+            compiled_finders.append(etree.XPath(section_finder))
+
+    if union:
+        compiled_finders.append(etree.XPath(' | '.join(union)))
+
+    return compiled_finders
+
+
+_bad_link_section_finders = compile_section_finders(link_bad_section_finders())
+_find_links = etree.XPath("//a")
+
+
+def _find_useful_links(tree):
+    links = []
+
+    if tree is None:
+        return []
+
+    for section_finder in _bad_link_section_finders:
+        for bad_section in section_finder(tree):
             bad_section.clear()
 
     # now get the links
-    link_elements = tree.xpath("//a")
+    link_elements = _find_links(tree)
 
     for link in link_elements:
         link_text = link.text_content().strip().lower()
@@ -1469,31 +1556,37 @@ def get_useful_links(page):
     return links
 
 
+def license_bad_section_finders():
+    # sections to remove before looking for license text
+    return [
+        "//div[contains(@class, 'view-pnas-featured')]",  # https://www.pnas.org/content/114/38/10035
+        "//meta[contains(@name, 'citation_reference')]",  # https://www.thieme-connect.de/products/ebooks/lookinside/10.1055/sos-SD-226-00098
+    ]
+
+
+_bad_license_section_finders = compile_section_finders(license_bad_section_finders())
+
+
 def page_potential_license_text(page):
-    tree = get_tree(page)
+    parsed_page = as_parsed_page(page)
+    tree = parsed_page.tree
 
     if tree is None:
-        return page
-
-    section_removed = False
+        return parsed_page.text
 
-    bad_section_finders = [
-        "//div[contains(@class, 'view-pnas-featured')]",  # https://www.pnas.org/content/114/38/10035
-        "//meta[contains(@name, 'citation_reference')]",  # https://www.thieme-connect.de/products/ebooks/lookinside/10.1055/sos-SD-226-00098
-    ]
+    if not any(section_finder(tree) for section_finder in _bad_license_section_finders):
+        return parsed_page.text
 
-    for section_finder in bad_section_finders:
-        for bad_section in tree.xpath(section_finder):
+    # the tree is shared with the other extractors, so clear sections in a copy
+    tree = parsed_page.tree_copy()
+    for section_finder in _bad_license_section_finders:
+        for bad_section in section_finder(tree):
             bad_section.clear()
-            section_removed = True
-
-    if not section_removed:
-        return page
 
     try:
         return etree.tostring(tree, encoding=str)
     except Exception:
-        return page
+        return parsed_page.text
 
 
 def is_purchase_link(link):
@@ -1504,8 +1597,14 @@ def is_purchase_link(link):
     return False
 
 
-def has_bad_href_word(href):
-    href_blacklist = [
+def compile_word_list(words):
+    # one alternation that finds any of the words in lowercased text,
+    # the same as checking `word.lower() in text.lower()` for each word
+    return re.compile('|'.join(re.escape(word.lower()) for word in words))
+
+
+def bad_href_words():
+    return [
         # = closed 10.1021/acs.jafc.6b02480
         # editorial and advisory board
         "/eab/",
@@ -1693,34 +1792,43 @@ def has_bad_href_word(href):
         'WOS000382116900027.pdf',
     ]
 
-    href_whitelist = [
+def good_href_words():
+    return [
         # https://zenodo.org/record/3831263
         '190317_MainText_Figures_JNNP.pdf',
         # https://archive.nyu.edu/handle/2451/34777?mode=full
         'Using%20Google%20Forms%20to%20Track%20Library%20Space%20Usage%20w%20figures.pdf',
     ]
 
-    for good_word in href_whitelist:
-        if good_word.lower() in href.lower():
-            return False
-
-    for bad_word in href_blacklist:
-        if bad_word.lower() in href.lower():
-            return True
 
-    bad_patterns = [
+def bad_href_patterns():
+    return [
         r'jmir_v[a-z0-9]+_app\d+\.pdf',  # https://www.jmir.org/2019/9/e15011
     ]
 
-    for bad_pattern in bad_patterns:
-        if re.findall(bad_pattern, href, re.IGNORECASE):
-            return True
+
+_good_href_word_re = compile_word_list(good_href_words())
+_bad_href_word_re = compile_word_list(bad_href_words())
+_bad_href_pattern_re = re.compile('|'.join(bad_href_patterns()), re.IGNORECASE)
+
+
+def has_bad_href_word(href):
+    href_lower = href.lower()
+
+    if _good_href_word_re.search(href_lower):
+        return False
+
+    if _bad_href_word_re.search(href_lower):
+        return True
+
+    if _bad_href_pattern_re.search(href):
+        return True
 
     return False
 
 
-def has_bad_anchor_word(anchor_text):
-    anchor_blacklist = [
+def bad_anchor_words():
+    return [
         # = closed repo https://works.bepress.com/ethan_white/27/
         "user",
         "guide",
@@ -1804,19 +1912,24 @@ def has_bad_anchor_word(anchor_text):
         'Reprint Order Form',
         'Cost Confirmation and Order Form',
     ]
-    for bad_word in anchor_blacklist:
-        if bad_word.lower() in anchor_text.lower():
-            return True
 
-    return False
+
+_bad_anchor_word_re = compile_word_list(bad_anchor_words())
+
+
+def has_bad_anchor_word(anchor_text):
+    return bool(_bad_anchor_word_re.search(anchor_text.lower()))
 
 
 def get_pdf_in_meta(page):
+    parsed_page = as_parsed_page(page)
+    page = parsed_page.text
+
     if "citation_pdf_url" in page:
         if DEBUG_SCRAPING:
             logger.info("citation_pdf_url in page")
 
-        tree = get_tree(page)
+        tree = parsed_page.tree
         if tree is not None:
             metas = tree.xpath("//meta")
             for meta in metas: